@@ -5,13 +5,25 @@ from cloud.aws_api import AwsApi
 from core import utils
 from core.event_bus import EventBus
 from pathlib import Path
+import os
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 
 class AwsClient(CloudClient):
     """Implements access to AWS cloud"""
     MYNAME = 'cloud.api'
     REQ_CFG_OPTIONS = ['deviceId', 'customerId', 'iot', 'api_endpoints']
+    # Size of the HTTP connection pool per host, covers concurrent image downloads
+    HTTP_POOL_SIZE = 16
+    # Retries of idempotent requests answered by a temporarily unavailable server or gateway, connection errors and
+    # timeouts are not retried here, callers handle them
+    HTTP_STATUS_RETRIES = 3
+    HTTP_RETRY_BACKOFF_FACTOR = 0.3
+    HTTP_RETRY_STATUSES = (502, 503, 504)
+    DOWNLOAD_CHUNK_SIZE = 65536
 
     def __init__(self, config_data: dict, logger: Logger, ev_bus: EventBus):
         super().__init__(AwsClient.MYNAME, config_data, logger, ev_bus)
@@ -19,6 +31,14 @@ class AwsClient(CloudClient):
         self._customer_id = ''
         self._iot_client = MqttClient(self._config.get('iot', {}), logger)
         self._endpoints = dict()
+        # All HTTP requests share one session, so connections to the same host are kept alive and reused
+        self._http = requests.Session()
+        retry = Retry(total=AwsClient.HTTP_STATUS_RETRIES, connect=0, read=0,
+                      backoff_factor=AwsClient.HTTP_RETRY_BACKOFF_FACTOR,
+                      status_forcelist=AwsClient.HTTP_RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=AwsClient.HTTP_POOL_SIZE, max_retries=retry)
+        self._http.mount('https://', adapter)
+        self._http.mount('http://', adapter)
 
     def _get_my_required_cfg_options(self) -> list:
         return AwsClient.REQ_CFG_OPTIONS
@@ -36,12 +56,13 @@ class AwsClient(CloudClient):
                 endpoint['value'] = endpoint['value'].replace(utils.DEVICE_ID_PLACEHOLDER, self._device_id)
             if utils.CUSTOMER_ID_PLACEHOLDER in endpoint['value']:
                 endpoint['value'] = endpoint['value'].replace(utils.CUSTOMER_ID_PLACEHOLDER, self._customer_id)
-            self._endpoints[endpoint['name']] = AwsApi(endpoint['key'], endpoint['value'])
+            self._endpoints[endpoint['name']] = AwsApi(endpoint['key'], endpoint['value'], self._http)
         super().start()
         self._logger.info("AWS Cloud client started")
 
     def stop(self):
         super().stop()
+        self._http.close()
         self._logger.info("AWS Cloud client stopped")
 
     def _fill_common_fields(self, d: dict):
@@ -81,17 +102,23 @@ class AwsClient(CloudClient):
             self._logger.error(f"Unable to extract name from the url ({url})")
             raise utils.CloudApiImageDownloadError("Failed to get image file name from URL")
         image_fname = save_to.joinpath(name)
+        # The same image may be downloaded by several threads at once, each one writes its own temporary file
+        tmp_fname = save_to.joinpath(f"{name}.{threading.get_ident()}.tmp")
         try:
-            r = requests.get(url, timeout=AwsApi.HTTP_TIMEOUT_SECS)
-        except requests.exceptions.ConnectionError as e:
+            with self._http.get(url, timeout=AwsApi.HTTP_TIMEOUT_SECS, stream=True) as r:
+                if r.status_code != requests.codes.ok:
+                    raise utils.CloudApiServerError(r.status_code, r.text)
+                # The image is written as it arrives instead of being held in memory as a whole
+                with open(tmp_fname, 'wb') as fb:
+                    for chunk in r.iter_content(AwsClient.DOWNLOAD_CHUNK_SIZE):
+                        fb.write(chunk)
+            os.replace(tmp_fname, image_fname)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
             raise utils.CloudApiConnectionError(str(e))
         except requests.exceptions.Timeout:
             raise utils.CloudApiTimeoutError
-        else:
-            if r.status_code == requests.codes.ok:
-                with open(image_fname, 'wb') as fb:
-                    fb.write(r.content)
-                self._logger.debug(f"Image file {name} is downloaded and stored")
-                return name
-            else:
-                raise utils.CloudApiServerError(r.status_code, r.text)
+        finally:
+            # Still exists only if the download failed, such a file is never reused, so it is removed
+            tmp_fname.unlink(missing_ok=True)
+        self._logger.debug(f"Image file {name} is downloaded and stored")
+        return name
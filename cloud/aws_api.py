@@ -7,9 +7,10 @@ class AwsApi:
     """Implements access to AWS HTTP APIs"""
     HTTP_TIMEOUT_SECS = 15
 
-    def __init__(self, key: str, url: str):
+    def __init__(self, key: str, url: str, session: requests.Session):
         self._api_key = key
         self._api_url = url
+        self._session = session
 
     def get(self, params: dict) -> dict:
         headers = {}
@@ -19,7 +20,7 @@ class AwsApi:
         for k, v in params.items():
             url += f"&{k}=v"
         try:
-            r = requests.get(url, headers=headers, timeout=AwsApi.HTTP_TIMEOUT_SECS)
+            r = self._session.get(url, headers=headers, timeout=AwsApi.HTTP_TIMEOUT_SECS)
             if r.status_code == requests.codes.ok:
                 try:
                     obj = r.json()
@@ -34,14 +35,15 @@ class AwsApi:
             raise CloudApiTimeoutError
 
     def post(self, obj: dict, response_back: bool = False) -> dict | None:
-        data = json.dumps(obj)
+        # Compact separators and a single encoding step, the body is sent as bytes and its length is in bytes
+        data = json.dumps(obj, separators=(',', ':')).encode('utf-8')
         headers = {}
-        if len(self._api_url) > 0:
+        if len(self._api_key) > 0:
             headers["X-Api-Key"] = self._api_key
         headers['Content-Type'] = 'application/json'
         headers['Content-Length'] = str(len(data))
         try:
-            r = requests.post(self._api_url, headers=headers, timeout=AwsApi.HTTP_TIMEOUT_SECS)
+            r = self._session.post(self._api_url, data=data, headers=headers, timeout=AwsApi.HTTP_TIMEOUT_SECS)
             if r.status_code == requests.codes.ok:
                 if response_back:
                     try:
@@ -1,9 +1,8 @@
 from abc import ABC, abstractmethod
 from enum import Enum, auto, unique
-from threading import Thread, Condition
-from collections import deque
+from threading import Thread
+from queue import SimpleQueue
 from collections.abc import Callable
-from copy import deepcopy
 from core.logger import Logger
 from core.utils import check_config, ConfigError
 
@@ -14,6 +13,8 @@ class AppModuleEventType(Enum):
 
 
 class AppModuleEvent:
+    __slots__ = ('type', 'body')
+
     def __init__(self, ev_type: AppModuleEventType, ev_body: dict):
         self.type: AppModuleEventType = ev_type
         self.body: dict = ev_body
@@ -55,37 +56,43 @@ class AppModuleWithEvents(AppModule):
     """Base class for application modules that require triggering and processing of internal events"""
     def __init__(self, modname: str, config_data: dict, logger: Logger):
         super().__init__(modname, config_data, logger)
-        self._event_q: deque[AppModuleEvent | None] = deque()
-        self._cv: Condition = Condition()
+        self._event_q: SimpleQueue[AppModuleEvent | None] = SimpleQueue()
         self._event_thread: Thread = Thread(target=self._event_processing_worker)
-        self._stopped = False
         self._ev_handlers: dict[AppModuleEventType, EventHandlerT] = dict()
+        # Fields an event body must contain, checked when the event is put to the queue
+        self._ev_required_fields: dict[AppModuleEventType, tuple[str, ...]] = dict()
 
     def start(self):
         super().start()
         self._event_thread.start()
 
     def stop(self):
-        self._stopped = True
-        with self._cv:
-            self._event_q.appendleft(None)
-            self._cv.notify()
+        # None is a sentinel that terminates the worker after all events queued before it are processed
+        self._event_q.put(None)
         self._event_thread.join()
         super().stop()
 
     def _event_processing_worker(self):
         """Processes internal events in a separate thread"""
-        while not self._stopped:
-            with self._cv:
-                self._cv.wait_for(lambda: len(self._event_q) > 0)
-                ev = self._event_q.pop()
-                if ev is not None and ev.type in self._ev_handlers:
-                    self._ev_handlers[ev.type](ev.body)
-
-    def _register_ev_handler(self, ev_type: AppModuleEventType, handler: EventHandlerT):
+        while True:
+            ev = self._event_q.get()
+            if ev is None:
+                break
+            handler = self._ev_handlers.get(ev.type)
+            if handler is not None:
+                handler(ev.body)
+
+    def _register_ev_handler(self, ev_type: AppModuleEventType, handler: EventHandlerT,
+                             required_fields: tuple[str, ...] = ()):
+        """Handler can access required_fields of the event body without checks, as events without them are dropped"""
         self._ev_handlers[ev_type] = handler
+        if len(required_fields) > 0:
+            self._ev_required_fields[ev_type] = required_fields
 
     def _put_event(self, ev_type: AppModuleEventType, ev_body: dict):
-        with self._cv:
-            self._event_q.appendleft(AppModuleEvent(ev_type, deepcopy(ev_body)))
-            self._cv.notify()
+        for field in self._ev_required_fields.get(ev_type, ()):
+            if field not in ev_body:
+                self._logger.error(f"Event {ev_type.name} is dropped, required field '{field}' is absent")
+                return
+        # Event bodies are passed by reference, handlers must treat them as read-only
+        self._event_q.put(AppModuleEvent(ev_type, ev_body))
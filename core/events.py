@@ -58,7 +58,7 @@ class EventType(Enum):
 #   no fields
 #
 # PLANOGRAM_UPDATE_DONE
-#   no fields
+#   'variants': list[int] - IDs of variants whose slots were changed
 #
 # GET_PLANOGRAM
 #   no fields
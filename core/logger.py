@@ -18,34 +18,36 @@ def get_log_level(lev: str) -> int:
 
 
 class ModuleLogger:
-    """A helper class that provides logging facility for a module"""
+    """A helper class that provides logging facility for a module.
+       Optional args are merged into msg using %-formatting only if the record is actually emitted.
+    """
     def __init__(self, module: str, level: str):
         self._logger = logging.getLogger(LOGGER_NAME + '.' + module)
         self._level = get_log_level(level)
 
-    def debug(self, msg: str):
+    def debug(self, msg: str, *args):
         """Invokes debug method of module's logger if the configured module's level allows it"""
         if self._level <= logging.DEBUG:
-            self._logger.debug(msg, stacklevel=2)
+            self._logger.debug(msg, *args, stacklevel=2)
 
-    def info(self, msg: str):
+    def info(self, msg: str, *args):
         """Invokes info method of module's logger if the configured module's level allows it"""
         if self._level <= logging.INFO:
-            self._logger.info(msg, stacklevel=2)
+            self._logger.info(msg, *args, stacklevel=2)
 
-    def warning(self, msg: str):
+    def warning(self, msg: str, *args):
         """Invokes warning method of module's logger if the configured module's level allows it"""
         if self._level <= logging.WARNING:
-            self._logger.warning(msg, stacklevel=2)
+            self._logger.warning(msg, *args, stacklevel=2)
 
-    def error(self, msg: str):
+    def error(self, msg: str, *args):
         """Invokes error method of module's logger if the configured module's level allows it"""
         if self._level <= logging.ERROR:
-            self._logger.error(msg, stacklevel=2)
+            self._logger.error(msg, *args, stacklevel=2)
 
-    def critical(self, msg: str):
+    def critical(self, msg: str, *args):
         """Invokes critical method of module's logger"""
-        self._logger.critical(msg, stacklevel=2)
+        self._logger.critical(msg, *args, stacklevel=2)
 
 
 class Logger:
@@ -77,22 +79,22 @@ class Logger:
         self._modules[module] = mod_logger
         return mod_logger
 
-    def debug(self, msg: str):
+    def debug(self, msg: str, *args):
         """Invokes debug method of main logger"""
-        self._logger.debug(msg, stacklevel=2)
+        self._logger.debug(msg, *args, stacklevel=2)
 
-    def info(self, msg: str):
+    def info(self, msg: str, *args):
         """Invokes info method of main logger"""
-        self._logger.info(msg, stacklevel=2)
+        self._logger.info(msg, *args, stacklevel=2)
 
-    def warning(self, msg: str):
+    def warning(self, msg: str, *args):
         """Invokes warning method of main logger"""
-        self._logger.warning(msg, stacklevel=2)
+        self._logger.warning(msg, *args, stacklevel=2)
 
-    def error(self, msg: str):
+    def error(self, msg: str, *args):
         """Invokes error method of main logger"""
-        self._logger.error(msg, stacklevel=2)
+        self._logger.error(msg, *args, stacklevel=2)
 
-    def critical(self, msg: str):
+    def critical(self, msg: str, *args):
         """Invokes critical method of main logger"""
-        self._logger.critical(msg, stacklevel=2)
+        self._logger.critical(msg, *args, stacklevel=2)
@@ -7,8 +7,9 @@ from core.appmodule import AppModule
 from core.utils import ModuleStartupError
 
 
-# All request handlers except for OPTIONS are expected to return (status_code, output_headers, response_body)
-RequestHandlerResult = tuple[int, dict, str]
+# All request handlers except for OPTIONS are expected to return (status_code, output_headers, response_body),
+# the body is already encoded, so Content-Length can be set from its length
+RequestHandlerResult = tuple[int, dict, bytes]
 
 
 class MyHTTPRequestHandler(BaseHTTPRequestHandler):
@@ -25,7 +26,7 @@ class MyHTTPRequestHandler(BaseHTTPRequestHandler):
                     self.send_header(key, value)
                 self.end_headers()
                 if len(out_body) > 0:
-                    self.wfile.write(out_body.encode())
+                    self.wfile.write(out_body)
             else:
                 log_msg = 'on_post callback is not set in HTTP Server instance'
                 if self.server._logger:
@@ -56,7 +57,7 @@ class MyHTTPRequestHandler(BaseHTTPRequestHandler):
                 self.send_header(key, value)
             self.end_headers()
             if len(out_body) > 0:
-                self.wfile.write(out_body.encode())
+                self.wfile.write(out_body)
         else:
             log_msg = 'on_get callback is not set in HTTP Server instance'
             if self.server._logger:
@@ -77,7 +78,7 @@ class MyHTTPRequestHandler(BaseHTTPRequestHandler):
                     self.send_header(key, value)
                 self.end_headers()
                 if len(out_body) > 0:
-                    self.wfile.write(out_body.encode())
+                    self.wfile.write(out_body)
             else:
                 log_msg = 'on_put callback is not set in HTTP Server instance'
                 if self.server._logger:
@@ -243,7 +244,7 @@ class RestServerBase(AppModule):
            Inputs: URL, request's headers, request's body.
            Outputs: Status code, response's headers, response's body.
         """
-        return HTTPStatus.NOT_IMPLEMENTED, {}, ''
+        return HTTPStatus.NOT_IMPLEMENTED, {}, b''
 
     @abstractmethod
     def _on_post(self, path: str, headers: dict, msg: str) -> RequestHandlerResult:
@@ -251,7 +252,7 @@ class RestServerBase(AppModule):
            Inputs: URL, request's headers, request's body.
            Outputs: Status code, response's headers, response's body.
         """
-        return HTTPStatus.NOT_IMPLEMENTED, {}, ''
+        return HTTPStatus.NOT_IMPLEMENTED, {}, b''
 
     @abstractmethod
     def _on_put(self, path: str, headers: dict, msg: str) -> RequestHandlerResult:
@@ -259,7 +260,7 @@ class RestServerBase(AppModule):
            Inputs: URL, request's headers, request's body.
            Outputs: Status code, response's headers, response's body.
         """
-        return HTTPStatus.NOT_IMPLEMENTED, {}, ''
+        return HTTPStatus.NOT_IMPLEMENTED, {}, b''
 
     @abstractmethod
     def _on_delete(self, path: str, headers: dict) -> RequestHandlerResult:
@@ -267,7 +268,7 @@ class RestServerBase(AppModule):
            Inputs: URL, request's headers.
            Outputs: Status code, response's headers, response's body.
         """
-        return HTTPStatus.NOT_IMPLEMENTED, {}, ''
+        return HTTPStatus.NOT_IMPLEMENTED, {}, b''
 
     @abstractmethod
     def _on_options(self, path: str, headers: dict) -> tuple[int, dict]:
@@ -1,5 +1,7 @@
 import hashlib
+import os
 import sys
+from pathlib import Path
 
 DEVICE_ID_PLACEHOLDER = '$deviceId'
 CUSTOMER_ID_PLACEHOLDER = '$customerId'
@@ -46,6 +48,13 @@ def get_name_from_url(url: str) -> str | None:
     return None
 
 
+def write_text_atomically(path: Path, text: str):
+    """Writes the text to a temporary file next to the given one and replaces it, so the file is never partial"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+
 def _myname_(o: object) -> str:
     return str(o.__class__).split("'")[1] + "." + sys._getframe(1).f_code.co_name
 
@@ -67,34 +76,55 @@ class ConfigError(Exception):
         self.failed_option = failed_opt
 
 
-class CloudApiFormatError(Exception):
+class CloudApiError(Exception):
+    """Base class for errors of Cloud API invocations"""
+    def log_message(self) -> str:
+        """Returns description of the error to be appended to a log message"""
+        return "unknown error"
+
+
+class CloudApiFormatError(CloudApiError):
     def __init__(self, msg: str):
         self.msg = msg
 
+    def log_message(self) -> str:
+        return f"malformed response - {self.msg}"
+
 
-class CloudApiServerError(Exception):
+class CloudApiServerError(CloudApiError):
     def __init__(self, status_code: int, response: str):
         self.status_code = status_code
         self.response = response
 
+    def log_message(self) -> str:
+        return f"server returned: code {self.status_code}, message ({self.response})"
 
-class CloudApiConnectionError(Exception):
+
+class CloudApiConnectionError(CloudApiError):
     def __init__(self, msg: str):
         self.msg = msg
 
+    def log_message(self) -> str:
+        return f"failed to connect - {self.msg}"
 
-class CloudApiTimeoutError(Exception):
-    pass
 
+class CloudApiTimeoutError(CloudApiError):
+    def log_message(self) -> str:
+        return "timeout"
 
-class CloudApiNotFound(Exception):
-    pass
 
+class CloudApiNotFound(CloudApiError):
+    def log_message(self) -> str:
+        return "API is not found in the Cloud client"
 
-class CloudApiImageDownloadError(Exception):
+
+class CloudApiImageDownloadError(CloudApiError):
     def __init__(self, msg: str):
         self.msg = msg
 
+    def log_message(self) -> str:
+        return f"failed to download image - {self.msg}"
+
 
 class UnsupportedFeatureError(Exception):
     def __init__(self, feature: str):
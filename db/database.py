@@ -99,6 +99,26 @@ class Database(AppModule):
                 self._logger.error(f"Failed to update user - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to update user", str(e))
 
+    def get_global_config(self, key: str) -> str | None:
+        with self._lock:
+            try:
+                cur = self._db.execute("SELECT value FROM global_config WHERE key=?", (key,))
+                row = cur.fetchone()
+                return None if row is None else row[0]
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get global config {key} - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get global config", str(e))
+
+    def set_global_config(self, key: str, value: str):
+        with self._lock:
+            try:
+                self._db.execute("INSERT INTO global_config (key, value) VALUES (?,?) "
+                                 "ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+                self._db.commit()
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to set global config {key} - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to set global config", str(e))
+
     def add_media(self, m: model.Media) -> int:
         with self._lock:
             try:
@@ -137,15 +157,7 @@ class Database(AppModule):
     def add_collection(self, coll: model.Collection):
         with self._lock:
             try:
-                cur = self._db.cursor()
-                cur.execute("INSERT INTO collection (id, last_update, media_id) VALUES (?,?,?)",
-                            (coll.obj_id, coll.last_update, coll.media_id))
-                for lang, info in coll.info.items():
-                    cur.execute("INSERT INTO collection_info (collection_id, language, name, description) "
-                                "VALUES(?,?,?,?)", (coll.obj_id, lang, info.name, info.description))
-                for prod_id in coll.products:
-                    cur.execute("INSERT INTO product_collection (product_id, collection_id) VALUES(?,?)",
-                                (prod_id, coll.obj_id))
+                self._write_collection(self._db.cursor(), coll, True)
                 self._db.commit()
             except sqlite3.DatabaseError as e:
                 self._logger.error(f"Failed to add collection - {str(e)}")
@@ -180,22 +192,28 @@ class Database(AppModule):
     def update_collection(self, coll: model.Collection):
         with self._lock:
             try:
-                cur = self._db.cursor()
-                cur.execute("UPDATE collection SET last_update=?, media_id=? WHERE id=?",
-                            (coll.last_update, coll.media_id, coll.obj_id))
-                cur.execute("DELETE FROM collection_info WHERE collection_id=?", (coll.obj_id,))
-                for lang, info in coll.info.items():
-                    cur.execute("INSERT INTO collection_info (collection_id, language, name, description) "
-                                "VALUES(?,?,?,?)", (coll.obj_id, lang, info.name, info.description))
-                cur.execute("DELETE FROM product_collection WHERE collection_id=?", (coll.obj_id,))
-                for prod_id in coll.products:
-                    cur.execute("INSERT INTO product_collection (product_id, collection_id) VALUES(?,?)",
-                                (prod_id, coll.obj_id))
+                self._write_collection(self._db.cursor(), coll, False)
                 self._db.commit()
             except sqlite3.DatabaseError as e:
                 self._logger.error(f"Failed to update collection {coll.obj_id} - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to update collection", str(e))
 
+    @staticmethod
+    def _write_collection(cur: sqlite3.Cursor, coll: model.Collection, is_new: bool):
+        """Inserts or updates the collection with its info and products, doesn't commit"""
+        if is_new:
+            cur.execute("INSERT INTO collection (id, last_update, media_id) VALUES (?,?,?)",
+                        (coll.obj_id, coll.last_update, coll.media_id))
+        else:
+            cur.execute("UPDATE collection SET last_update=?, media_id=? WHERE id=?",
+                        (coll.last_update, coll.media_id, coll.obj_id))
+            cur.execute("DELETE FROM collection_info WHERE collection_id=?", (coll.obj_id,))
+            cur.execute("DELETE FROM product_collection WHERE collection_id=?", (coll.obj_id,))
+        cur.executemany("INSERT INTO collection_info (collection_id, language, name, description) VALUES(?,?,?,?)",
+                        [(coll.obj_id, lang, info.name, info.description) for lang, info in coll.info.items()])
+        cur.executemany("INSERT INTO product_collection (product_id, collection_id) VALUES(?,?)",
+                        [(prod_id, coll.obj_id) for prod_id in coll.products])
+
     def remove_collection(self, obj_id: int):
         with self._lock:
             try:
@@ -236,15 +254,7 @@ class Database(AppModule):
     def add_product(self, prod: model.Product):
         with self._lock:
             try:
-                cur = self._db.cursor()
-                cur.execute("INSERT INTO product (id, last_update, type, tags) VALUES(?,?,?,?)",
-                            (prod.obj_id, prod.last_update, prod.prod_type, prod.tags))
-                for lang, info in prod.info.items():
-                    cur.execute("INSERT INTO product_info (product_id, language, name, description) VALUES(?,?,?,?)",
-                                (prod.obj_id, lang, info.name, info.description))
-                for lang, prop in prod.props.items():
-                    cur.execute("INSERT INTO product_property (product_id, language, type, name, value) "
-                                "VALUES(?,?,?,?,?)", (prod.obj_id, lang, prop.ptype, prop.name, prop.value))
+                self._write_product(self._db.cursor(), prod, True)
                 self._db.commit()
             except sqlite3.DatabaseError as e:
                 self._logger.error(f"Failed to add product - {str(e)}")
@@ -281,22 +291,28 @@ class Database(AppModule):
     def update_product(self, prod: model.Product):
         with self._lock:
             try:
-                cur = self._db.cursor()
-                cur.execute("UPDATE product SET last_update=?, type=?, tags=? WHERE id=?",
-                            (prod.last_update, prod.prod_type, prod.tags, prod.obj_id))
-                cur.execute("DELETE FROM product_info WHERE product_id=?", (prod.obj_id,))
-                for lang, info in prod.info.items():
-                    cur.execute("INSERT INTO product_info (product_id, language, name, description) VALUES(?,?,?,?)",
-                                (prod.obj_id, lang, info.name, info.description))
-                cur.execute("DELETE FROM product_property WHERE product_id=?", (prod.obj_id,))
-                for lang, prop in prod.props.items():
-                    cur.execute("INSERT INTO product_property (product_id, language, type, name, value) VALUES(?,?)",
-                                (prod.obj_id, lang, prop.ptype, prop.name, prop.value))
+                self._write_product(self._db.cursor(), prod, False)
                 self._db.commit()
             except sqlite3.DatabaseError as e:
                 self._logger.error(f"Failed to update product {prod.obj_id} - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to update product", str(e))
 
+    @staticmethod
+    def _write_product(cur: sqlite3.Cursor, prod: model.Product, is_new: bool):
+        """Inserts or updates the product with its info and properties, doesn't commit"""
+        if is_new:
+            cur.execute("INSERT INTO product (id, last_update, type, tags) VALUES(?,?,?,?)",
+                        (prod.obj_id, prod.last_update, prod.prod_type, prod.tags))
+        else:
+            cur.execute("UPDATE product SET last_update=?, type=?, tags=? WHERE id=?",
+                        (prod.last_update, prod.prod_type, prod.tags, prod.obj_id))
+            cur.execute("DELETE FROM product_info WHERE product_id=?", (prod.obj_id,))
+            cur.execute("DELETE FROM product_property WHERE product_id=?", (prod.obj_id,))
+        cur.executemany("INSERT INTO product_info (product_id, language, name, description) VALUES(?,?,?,?)",
+                        [(prod.obj_id, lang, info.name, info.description) for lang, info in prod.info.items()])
+        cur.executemany("INSERT INTO product_property (product_id, language, type, name, value) VALUES(?,?,?,?,?)",
+                        [(prod.obj_id, lang, prop.ptype, prop.name, prop.value) for lang, prop in prod.props.items()])
+
     def remove_product(self, obj_id: int):
         with self._lock:
             try:
@@ -333,23 +349,54 @@ class Database(AppModule):
                 self._logger.error(f"Failed to get all product IDs - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to get all product IDs", str(e))
 
+    @staticmethod
+    def _delete_not_in(cur: sqlite3.Cursor, table: str, kept_ids: set[int]):
+        """Removes rows of the table with IDs absent in kept_ids, doesn't commit.
+           IDs are passed through a temporary table, so their number is not limited by the number of SQL parameters.
+        """
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS kept_ids (id INTEGER PRIMARY KEY)")
+        cur.execute("DELETE FROM kept_ids")
+        cur.executemany("INSERT OR IGNORE INTO kept_ids (id) VALUES (?)", [(obj_id,) for obj_id in kept_ids])
+        cur.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT id FROM kept_ids)")
+
+    def get_product_versions(self) -> dict[int, float]:
+        """Returns last update time of every product by its ID"""
+        with self._lock:
+            try:
+                cur = self._db.execute("SELECT id, last_update FROM product")
+                return {row[0]: row[1] for row in cur.fetchall()}
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get product versions - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get product versions", str(e))
+
+    def get_collection_versions(self) -> dict[int, tuple[float, int | None, model.Media | None]]:
+        """Returns last update time, media ID and media of every collection by its ID"""
+        with self._lock:
+            try:
+                cur = self._db.execute("SELECT c.id, c.last_update, c.media_id, m.filename, m.last_update "
+                                       "FROM collection c LEFT JOIN media m ON m.id=c.media_id")
+                return {row[0]: (row[1], row[2], model.Media(row[3], row[4]) if row[3] is not None else None)
+                        for row in cur.fetchall()}
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get collection versions - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get collection versions", str(e))
+
+    def get_variant_media(self) -> dict[int, tuple[int | None, model.Media | None]]:
+        """Returns media ID and media of every variant by its ID"""
+        with self._lock:
+            try:
+                cur = self._db.execute("SELECT v.id, v.media_id, m.filename, m.last_update "
+                                       "FROM variant v LEFT JOIN media m ON m.id=v.media_id")
+                return {row[0]: (row[1], model.Media(row[2], row[3]) if row[2] is not None else None)
+                        for row in cur.fetchall()}
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get variant media - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get variant media", str(e))
+
     def add_variant(self, var: model.Variant):
         with self._lock:
             try:
-                cur = self._db.cursor()
-                cur.execute("INSERT INTO variant (id, product_id, price, price_compare, price_formatted, "
-                            "price_compare_formatted, deleted, media_id) VALUES(?,?,?,?,?,?,?,? )",
-                            (var.obj_id, var.prod_id, var.price, var.price_comp, var.price_fmt, var.price_comp_fmt,
-                             1 if var.deleted else 0, var.media_id))
-                for lang, info in var.info.items():
-                    cur.execute("INSERT INTO variant_info (variant_id, language, name, description) VALUES(?,?,?,?)",
-                                (var.obj_id, lang, info.name, info.description))
-                for lang, prop in var.props.items():
-                    cur.execute("INSERT INTO variant_property (product_id, language, type, name, value) "
-                                "VALUES(?,?,?,?,?)", (var.obj_id, lang, prop.ptype, prop.name, prop.value))
-                for opt in var.options:
-                    cur.execute("INSERT INTO variant_option (variant_id, option, value) VALUES(?,?,?)",
-                                (opt.variant_id, opt.option, opt.value))
+                self._write_variant(self._db.cursor(), var, True)
                 self._db.commit()
             except sqlite3.DatabaseError as e:
                 self._logger.error(f"Failed to add variant - {str(e)}")
@@ -390,29 +437,72 @@ class Database(AppModule):
     def update_variant(self, var: model.Variant):
         with self._lock:
             try:
-                cur = self._db.cursor()
-                cur.execute(
-                    "UPDATE variant SET price=?, price_compare=?, price_formatted=?, price_compare_formatted=?, "
-                    "deleted=?, media_id=? WHERE id=?",
-                    (var.price, var.price_comp, var.price_fmt, var.price_comp_fmt,
-                     1 if var.deleted else 0, var.media_id, var.obj_id))
-                cur.execute("DELETE FROM variant_info WHERE variant_id=?", (var.obj_id,))
-                for lang, info in var.info.items():
-                    cur.execute("INSERT INTO variant_info (variant_id, language, name, description) VALUES(?,?,?,?)",
-                                (var.obj_id, lang, info.name, info.description))
-                cur.execute("DELETE FROM variant_property WHERE variant_id=?", (var.obj_id,))
-                for lang, prop in var.props.items():
-                    cur.execute("INSERT INTO variant_property (variant_id, language, type, name, value) VALUES(?,?)",
-                                (var.obj_id, lang, prop.ptype, prop.name, prop.value))
-                cur.execute("DELETE FROM variant_option WHERE variant_id=?", (var.obj_id,))
-                for opt in var.options:
-                    cur.execute("INSERT INTO variant_option (variant_id, option, value) VALUES(?,?,?)",
-                                opt.variant_id, opt.option, opt.value)
+                self._write_variant(self._db.cursor(), var, False)
                 self._db.commit()
             except sqlite3.DatabaseError as e:
                 self._logger.error(f"Failed to update variant {var.obj_id} - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to update variant", str(e))
 
+    @staticmethod
+    def _write_variant(cur: sqlite3.Cursor, var: model.Variant, is_new: bool):
+        """Inserts or updates the variant with its info, properties and options, doesn't commit"""
+        if is_new:
+            cur.execute("INSERT INTO variant (id, product_id, price, price_compare, price_formatted, "
+                        "price_compare_formatted, deleted, media_id) VALUES(?,?,?,?,?,?,?,?)",
+                        (var.obj_id, var.prod_id, var.price, var.price_comp, var.price_fmt, var.price_comp_fmt,
+                         1 if var.deleted else 0, var.media_id))
+        else:
+            cur.execute("UPDATE variant SET price=?, price_compare=?, price_formatted=?, price_compare_formatted=?, "
+                        "deleted=?, media_id=? WHERE id=?",
+                        (var.price, var.price_comp, var.price_fmt, var.price_comp_fmt,
+                         1 if var.deleted else 0, var.media_id, var.obj_id))
+            cur.execute("DELETE FROM variant_info WHERE variant_id=?", (var.obj_id,))
+            cur.execute("DELETE FROM variant_property WHERE variant_id=?", (var.obj_id,))
+            cur.execute("DELETE FROM variant_option WHERE variant_id=?", (var.obj_id,))
+        cur.executemany("INSERT INTO variant_info (variant_id, language, name, description) VALUES(?,?,?,?)",
+                        [(var.obj_id, lang, info.name, info.description) for lang, info in var.info.items()])
+        cur.executemany("INSERT INTO variant_property (variant_id, language, type, name, value) VALUES(?,?,?,?,?)",
+                        [(var.obj_id, lang, prop.ptype, prop.name, prop.value) for lang, prop in var.props.items()])
+        cur.executemany("INSERT INTO variant_option (variant_id, option, value) VALUES(?,?,?)",
+                        [(opt.variant_id, opt.option, opt.value) for opt in var.options])
+
+    def apply_catalog_batch(self, added_products: list[model.Product] = (),
+                            updated_products: list[model.Product] = (),
+                            added_collections: list[model.Collection] = (),
+                            updated_collections: list[model.Collection] = (),
+                            added_variants: list[model.Variant] = (), updated_variants: list[model.Variant] = (),
+                            kept_variants: set[int] | None = None, kept_products: set[int] | None = None,
+                            kept_collections: set[int] | None = None):
+        """Applies changes of products, collections and variants in a single transaction.
+           If a kept_* list is given, all objects of that kind with IDs absent in it are removed.
+        """
+        with self._lock:
+            try:
+                cur = self._db.cursor()
+                for prod in added_products:
+                    self._write_product(cur, prod, True)
+                for prod in updated_products:
+                    self._write_product(cur, prod, False)
+                for coll in added_collections:
+                    self._write_collection(cur, coll, True)
+                for coll in updated_collections:
+                    self._write_collection(cur, coll, False)
+                for var in added_variants:
+                    self._write_variant(cur, var, True)
+                for var in updated_variants:
+                    self._write_variant(cur, var, False)
+                if kept_variants is not None:
+                    self._delete_not_in(cur, 'variant', kept_variants)
+                if kept_products is not None:
+                    self._delete_not_in(cur, 'product', kept_products)
+                if kept_collections is not None:
+                    self._delete_not_in(cur, 'collection', kept_collections)
+                self._db.commit()
+            except sqlite3.DatabaseError as e:
+                self._db.rollback()
+                self._logger.error(f"Failed to apply catalog changes - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to apply catalog changes", str(e))
+
     def remove_variant(self, obj_id: int):
         with self._lock:
             try:
@@ -523,6 +613,26 @@ class Database(AppModule):
                                    f"{inv_item.unit_id}:{inv_item.tray_number}:{inv_item.location} - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to remove inventory item", str(e))
 
+    def apply_inventory_batch(self, added: list[model.InventoryItem] = (), updated: list[model.InventoryItem] = (),
+                              removed: list[model.InventoryItem] = ()):
+        """Applies inventory changes in a single transaction, items are identified by unit, tray and location"""
+        with self._lock:
+            try:
+                cur = self._db.cursor()
+                cur.executemany("DELETE FROM inventory WHERE unit_id=? AND tray_number=? AND location=?",
+                                [(i.unit_id, i.tray_number, i.location) for i in removed])
+                cur.executemany("UPDATE inventory SET variant_id=?, width=?, depth=?, quantity=? "
+                                "WHERE unit_id=? AND tray_number=? AND location=?",
+                                [(i.variant_id, i.width, i.depth, i.quantity, i.unit_id, i.tray_number, i.location)
+                                 for i in updated])
+                cur.executemany("INSERT INTO inventory (unit_id, tray_number, location, variant_id, width, quantity, "
+                                "depth) VALUES(?,?,?,?,?,?,?)", added)
+                self._db.commit()
+            except sqlite3.DatabaseError as e:
+                self._db.rollback()
+                self._logger.error(f"Failed to apply inventory changes - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to apply inventory changes", str(e))
+
     def get_inventory_items_by_variant(self, variant_id: int) -> list[model.InventoryItem]:
         with self._lock:
             inv_items = list()
@@ -537,6 +647,20 @@ class Database(AppModule):
                 self._logger.error(f"Failed to get inventory items for variant {variant_id} - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to get inventory items", str(e))
 
+    def get_inventory_quantities_by_variants(self, variant_ids: list[int]) -> dict[int, int]:
+        """Returns total quantity in the inventory of every given variant by its ID, absent variants are omitted"""
+        if not variant_ids:
+            return dict()
+        with self._lock:
+            try:
+                cur = self._db.execute("SELECT variant_id, SUM(quantity) FROM inventory "
+                                       f"WHERE variant_id IN ({','.join('?' * len(variant_ids))}) GROUP BY variant_id",
+                                       variant_ids)
+                return {row[0]: row[1] for row in cur.fetchall()}
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get inventory quantities of variants - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get inventory quantities", str(e))
+
     def get_inventory_items_by_unit(self, unit_id: int) -> list[model.InventoryItem]:
         with self._lock:
             inv_items = list()
@@ -551,6 +675,15 @@ class Database(AppModule):
                 self._logger.error(f"Failed to get inventory items for unit {unit_id} - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to get inventory items", str(e))
 
+    def get_inventory_items(self) -> list[model.InventoryItem]:
+        with self._lock:
+            try:
+                cur = self._db.execute("SELECT * FROM inventory")
+                return [model.InventoryItem._make(row) for row in cur.fetchall()]
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get all inventory items - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get all inventory items", str(e))
+
     def add_cart(self, cart: model.Cart) -> int:
         with self._lock:
             try:
@@ -617,6 +750,21 @@ class Database(AppModule):
                 self._logger.error(f"Failed to remove cart - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to remove cart", str(e))
 
+    def get_carts_by_ids(self, cart_ids: list[int]) -> list[model.Cart]:
+        with self._lock:
+            carts = list()
+            try:
+                cur = self._db.cursor()
+                cur.execute(f"SELECT * FROM cart WHERE id IN ({','.join('?' * len(cart_ids))})", cart_ids)
+                for row in cur.fetchall():
+                    cart = model.Cart(row['id'], row['display_id'], row['transaction_id'], row['type'],
+                                      row['order_info'], row['status'], row['checkout_method'], row['locked_at'])
+                    carts.append(cart)
+                return carts
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get carts by ids - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get carts by ids", str(e))
+
     def get_carts(self, order_info: str = None) -> list[model.Cart]:
         with self._lock:
             carts = list()
@@ -659,6 +807,21 @@ class Database(AppModule):
                 self._logger.error(f"Failed to get cart contents for {cart_id} - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to get cart contents", str(e))
 
+    def get_order_items(self, cart_id: int) -> list[model.OrderItem]:
+        """Returns contents of the cart together with names and images of the variants"""
+        with self._lock:
+            try:
+                cur = self._db.execute("SELECT cc.variant_id, pi.name, vi.name, m.filename, cc.amount "
+                                       "FROM cart_contents cc JOIN variant v ON v.id=cc.variant_id "
+                                       "LEFT JOIN product_info pi ON pi.product_id=v.product_id AND pi.language=? "
+                                       "LEFT JOIN variant_info vi ON vi.variant_id=v.id AND vi.language=? "
+                                       "LEFT JOIN media m ON m.id=v.media_id WHERE cc.cart_id=?",
+                                       (self._lang, self._lang, cart_id))
+                return [model.OrderItem._make(row) for row in cur.fetchall()]
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get order items for cart {cart_id} - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get order items", str(e))
+
     def update_cart_item(self, ci: model.CartItem):
         with self._lock:
             try:
@@ -729,6 +892,34 @@ class Database(AppModule):
                 self._logger.error(f"Failed to remove reservation - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to remove reservation", str(e))
 
+    def apply_reservation_batch(self, added: list[model.Reservation] = (), updated: list[model.Reservation] = (),
+                                removed: list[int] = ()):
+        """Applies reservation changes in a single transaction.
+           Added reservations are merged into existing ones for the same cart, variant, unit and location.
+        """
+        with self._lock:
+            try:
+                cur = self._db.cursor()
+                for r in added:
+                    cur.execute("SELECT id, quantity FROM reservation WHERE cart_id=? AND unit_id=? AND location=? "
+                                "AND variant_id=?",
+                                (r.cart_id, r.unit_id, r.location, r.variant_id))
+                    row = cur.fetchone()
+                    if row is None:
+                        cur.execute("INSERT INTO reservation (cart_id, variant_id, unit_id, location, quantity) "
+                                    "VALUES (?,?,?,?,?)",
+                                    (r.cart_id, r.variant_id, r.unit_id, r.location, r.quantity))
+                    else:
+                        cur.execute("UPDATE reservation SET quantity=? WHERE id=?", (row[1] + r.quantity, row[0]))
+                cur.executemany("UPDATE reservation SET location=?, quantity=? WHERE id=?",
+                                [(r.location, r.quantity, r.id) for r in updated])
+                cur.executemany("DELETE FROM reservation WHERE id=?", [(r_id,) for r_id in removed])
+                self._db.commit()
+            except sqlite3.DatabaseError as e:
+                self._db.rollback()
+                self._logger.error(f"Failed to apply reservation changes - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to apply reservation changes", str(e))
+
     def get_reservations(self, variant_id: int, cart_id: int = 0) -> list[model.Reservation]:
         with self._lock:
             reservations = list()
@@ -746,6 +937,33 @@ class Database(AppModule):
                 self._logger.error(f"Failed to get reservations - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to get reservations", str(e))
 
+    def get_reservations_by_cart(self, cart_id: int) -> list[model.Reservation]:
+        with self._lock:
+            reservations = list()
+            try:
+                cur = self._db.cursor()
+                cur.execute("SELECT * FROM reservation WHERE cart_id=?", (cart_id,))
+                for row in cur.fetchall():
+                    r = model.Reservation._make(row)
+                    reservations.append(r)
+                return reservations
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get reservations for cart {cart_id} - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get reservations for cart", str(e))
+
+    def get_available_quantity(self, variant_id: int) -> tuple[int, int]:
+        """Returns total quantity of the variant in the inventory and its reserved quantity"""
+        with self._lock:
+            try:
+                cur = self._db.execute("SELECT (SELECT IFNULL(SUM(quantity), 0) FROM inventory WHERE variant_id=?), "
+                                       "(SELECT IFNULL(SUM(quantity), 0) FROM reservation WHERE variant_id=?)",
+                                       (variant_id, variant_id))
+                total, reserved = cur.fetchone()
+                return total, reserved
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to get available quantity of variant {variant_id} - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to get available quantity", str(e))
+
     def add_order_history_record(self, rec: model.OrderHistoryRecord) -> int:
         with self._lock:
             try:
@@ -768,6 +986,37 @@ class Database(AppModule):
                 self._logger.error(f"Failed to remove order history record - {str(e)}")
                 raise utils.DbError(_myname_(self), "Failed to remove order history record", str(e))
 
+    def remove_order_history_records(self, rec_ids: list[int]):
+        with self._lock:
+            try:
+                self._db.executemany("DELETE FROM order_history WHERE id=?", [(rec_id,) for rec_id in rec_ids])
+                self._db.commit()
+            except sqlite3.DatabaseError as e:
+                self._logger.error(f"Failed to remove order history records - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to remove order history records", str(e))
+
+    def replace_carts_with_order_history(self, cart_ids: list[int],
+                                         records: list[model.OrderHistoryRecord]) -> list[int]:
+        """Removes the carts and adds the order history records in a single transaction.
+           Returns IDs of the added records in the same order.
+        """
+        with self._lock:
+            try:
+                cur = self._db.cursor()
+                rec_ids = list()
+                for rec in records:
+                    cur.execute("INSERT INTO order_history (transaction_id, order_info, completion_cause, created_at) "
+                                "VALUES (?,?,?,?)",
+                                (rec.transaction_id, rec.order_info, int(rec.completion_status), rec.created_at))
+                    rec_ids.append(cur.lastrowid)
+                cur.executemany("DELETE FROM cart WHERE id=?", [(cart_id,) for cart_id in cart_ids])
+                self._db.commit()
+                return rec_ids
+            except sqlite3.DatabaseError as e:
+                self._db.rollback()
+                self._logger.error(f"Failed to replace carts with order history records - {str(e)}")
+                raise utils.DbError(_myname_(self), "Failed to replace carts with order history records", str(e))
+
     def get_order_history_records(self, order_info: str = None) -> list[model.OrderHistoryRecord]:
         with self._lock:
             records = list()
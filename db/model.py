@@ -69,9 +69,13 @@ ObjectInfo = namedtuple('Info', ['name', 'description'])
 Media = namedtuple('Media', ['filename', 'last_update'])
 VariantOption = namedtuple('VariantOption', ['variant_id', 'option', 'value'])
 CartItem = namedtuple('CartItem', ['cart_id', 'variant_id', 'amount'])
+# Cart item with the names in the configured language and the image of its variant, names are None if absent
+OrderItem = namedtuple('OrderItem', ['variant_id', 'product_name', 'variant_name', 'image', 'amount'])
 Reservation = namedtuple('Reservation', ['id', 'cart_id', 'variant_id', 'unit_id', 'location', 'quantity'])
 InventoryItem = namedtuple('InventoryItem', ['unit_id', 'tray_number', 'location', 'variant_id', 'width', 'quantity',
                                              'depth'])
+# Planogram slot of a tray
+Slot = namedtuple('Slot', ['width', 'depth', 'variant_id'])
 
 
 class Collection:
@@ -1,5 +1,9 @@
+import importlib
 import json
 import sys
+import signal
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from core.logger import Logger
 from core import utils
@@ -7,7 +11,6 @@ from core.event_bus import EventBus
 from db.database import Database
 from db.model import AccessLevel
 from cloud.cloud_client import CloudClient
-from cloud.aws import AwsClient
 from logic.planogram import PlanogramLogic
 from logic.cart import CartLogic
 from logic.machine import MachineLogic
@@ -18,10 +21,15 @@ from ui.ws_server import BackendWebsocketServer
 class KioskBackend:
     """Main Kiosk Backend application class"""
     CFG_FILE = 'config.json'
-    REQ_CFG_OPTIONS = ['general', 'database', 'cloud', 'cloud:type', 'hardware', 'communication', 'telemetry',
-                       'ui', 'ui:rest_server', 'ui:websocket_server',
-                       'logic', 'logic:planogram', 'logic:cart', 'logic:login', 'logger']
+    REQ_CFG_OPTIONS = frozenset({'general', 'database', 'cloud', 'hardware', 'communication', 'telemetry', 'ui',
+                                 'logic', 'logger'})
+    REQ_CFG_NESTED_OPTIONS = {'cloud': ('type',),
+                              'ui': ('rest_server', 'websocket_server'),
+                              'logic': ('planogram', 'cart', 'login')}
     DEFAULT_LANGUAGE = "en"
+    # Supported cloud types, mapped to module and class name of the client, imported only when selected
+    CLOUD_CLIENTS = {'aws': ('cloud.aws', 'AwsClient')}
+    _SEP = '=' * 80
 
     def __init__(self):
         try:
@@ -47,10 +55,11 @@ class KioskBackend:
         self._ui_backend: BackendRestServer = None
         self._ui_ws: BackendWebsocketServer = None
         self._machine_logic: MachineLogic = None
+        self._stop_event = Event()
 
     def start(self, args: list) -> bool:
         """Returns False if application should exit immediately"""
-        self._logger.info('='*80)
+        self._logger.info(KioskBackend._SEP)
         self._logger.info("JER Kiosk Backend application is starting")
         self._event_bus.validate_config()
         self._database.validate_config()
@@ -63,24 +72,28 @@ class KioskBackend:
             except utils.DbError:
                 pass
             return False
-        cloud_type = self._config['cloud']['type']
-        if cloud_type not in self._config['cloud']:
+        cloud_cfg = self._config['cloud']
+        logic_cfg = self._config['logic']
+        ui_cfg = self._config['ui']
+        cloud_type = cloud_cfg['type']
+        if cloud_type not in cloud_cfg:
             raise utils.ConfigError('cloud', cloud_type)
-        if cloud_type == 'aws':
-            self._cloud_client = AwsClient(self._config['cloud']['aws'], self._logger, self._event_bus)
-        else:
+        if cloud_type not in KioskBackend.CLOUD_CLIENTS:
             raise utils.UnsupportedFeatureError(f"Cloud type '{cloud_type}'")
+        mod_name, cls_name = KioskBackend.CLOUD_CLIENTS[cloud_type]
+        cloud_client_cls = getattr(importlib.import_module(mod_name), cls_name)
+        self._cloud_client = cloud_client_cls(cloud_cfg[cloud_type], self._logger, self._event_bus)
         self._cloud_client.validate_config()
-        self._planogram_logic = PlanogramLogic(self._config['logic']['planogram'], self._logger, self._event_bus,
+        self._planogram_logic = PlanogramLogic(logic_cfg['planogram'], self._logger, self._event_bus,
                                                self._cloud_client, self._database, self._data_dir, self._img_dir)
         self._planogram_logic.validate_config()
-        self._cart_logic = CartLogic(self._config['logic']['cart'], self._logger, self._event_bus,
+        self._cart_logic = CartLogic(logic_cfg['cart'], self._logger, self._event_bus,
                                      self._cloud_client, self._database)
         self._cart_logic.validate_config()
-        self._ui_backend = BackendRestServer(self._config['ui']['rest_server'], self._logger, self._event_bus,
+        self._ui_backend = BackendRestServer(ui_cfg['rest_server'], self._logger, self._event_bus,
                                              self._database, self._cart_logic, self._data_dir, self._lang)
         self._ui_backend.validate_config()
-        self._ui_ws = BackendWebsocketServer(self._config['ui']['websocket_server'], self._logger, self._event_bus,
+        self._ui_ws = BackendWebsocketServer(ui_cfg['websocket_server'], self._logger, self._event_bus,
                                              self._database)
         self._machine_logic = MachineLogic({}, self._logger, self._event_bus, self._planogram_logic)
         self._machine_logic.validate_config()
@@ -96,25 +109,44 @@ class KioskBackend:
 
     def cleanup(self):
         self._logger.info("JER Kiosk Backend application is stopping")
-        self._machine_logic.stop()
-        self._ui_ws.stop()
-        self._ui_backend.stop()
-        self._cart_logic.stop()
-        self._planogram_logic.stop()
-        self._event_bus.stop()
-        if self._cloud_client:
-            self._cloud_client.stop()
-        self._database.stop()
+        # Modules are stopped in waves, modules within one wave do not depend on each other and can be stopped
+        # concurrently, a wave starts only when all modules of the previous one are stopped
+        waves = ((self._machine_logic, self._ui_ws, self._ui_backend),
+                 (self._cart_logic, self._planogram_logic),
+                 (self._cloud_client,),
+                 (self._event_bus, self._database))
+        with ThreadPoolExecutor(max_workers=max(len(w) for w in waves)) as executor:
+            for wave in waves:
+                futures = [executor.submit(m.stop) for m in wave if m is not None]
+                wait(futures)
+                for f in futures:
+                    if f.exception() is not None:
+                        self._logger.error("Failed to stop module - %s", f.exception())
         self._logger.info("JER Kiosk Backend application stopped")
 
     def run(self):
+        """Blocks until the application is requested to stop with SIGINT or SIGTERM"""
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
         if self._cloud_client:
-            self._cloud_client.run()
+            # Cloud client loop blocks on its own network events and exits once the client is stopped
+            Thread(target=self._cloud_client.run, daemon=True).start()
+        self._stop_event.wait()
+
+    def _on_stop_signal(self, signum, frame):
+        self._logger.info("Received signal %d", signum)
+        self._stop_event.set()
 
     def _validate_config(self):
         res, opt = utils.check_config(self._config, KioskBackend.REQ_CFG_OPTIONS)
         if not res:
             raise utils.ConfigError('app', opt)
+        for section, options in KioskBackend.REQ_CFG_NESTED_OPTIONS.items():
+            if type(self._config[section]) != dict:
+                raise utils.ConfigError('app', section)
+            res, opt = utils.check_config(self._config[section], options)
+            if not res:
+                raise utils.ConfigError('app', opt)
 
 
 if __name__ == '__main__':
@@ -7,10 +7,13 @@ from core.events import EventType
 from db import model
 from core import utils
 import json
-from enum import Enum, auto, unique
-from threading import Timer
-from collections import namedtuple
+from enum import Enum, IntEnum, auto, unique
+from threading import Thread, Condition, Lock, Event as ThreadEvent
+from queue import Queue, Full
+from collections import namedtuple, defaultdict, deque
 import time
+import heapq
+from collections.abc import Callable
 
 
 @unique
@@ -22,6 +25,13 @@ class CartOperationResult(Enum):
     FAILURE = auto()
 
 
+@unique
+class ExpirationType(IntEnum):
+    CART = 1
+    RESERVATION = 2
+    ORDER_HISTORY = 3
+
+
 @unique
 class CartEventType(AppModuleEventType):
     PLANOGRAM_WAS_UPDATED = auto()
@@ -35,7 +45,7 @@ class CartEventType(AppModuleEventType):
 
 # Events structure:
 # PLANOGRAM_WAS_UPDATED
-#   no fields
+#   'variants': list[int]
 #
 # PROCESS_PENDING_RESERVATIONS
 #   'item': DispensingPendingItem
@@ -65,9 +75,12 @@ class CartEventType(AppModuleEventType):
 #
 
 
-ExpirationItem = namedtuple('ExpirationItem', ['obj_id', 'exp_at'])
 DispensingPendingItem = namedtuple('DispensingPendingItem', ['cart_id', 'reservations'])
 
+# Completion statuses posted on every reservation expiration or purchase, looked up once
+_STATUS_EXPIRED = model.ReservationCompletionStatus.EXPIRED
+_STATUS_DISPENSED = model.ReservationCompletionStatus.DISPENSED
+
 
 class CartLogic(AppModuleWithEvents):
     """Implements logic related to operations with virtual shopping cart both local and remote.
@@ -77,8 +90,9 @@ class CartLogic(AppModuleWithEvents):
     REQ_CFG_OPTIONS = ['expiration_timeout', 'prereservation_timeout', 'reservation_timeout',
                        'reservation_timeout:unit', 'reservation_timeout:value', 'order_history_timeout',
                        'order_history_timeout:unit', 'order_history_timeout:value']
-    EXP_LIST_CHECK_PERIOD_SEC = 5
-    EXP_TM_TICKS_IN_MINUTE = 60 // EXP_LIST_CHECK_PERIOD_SEC
+    CLOUD_TX_QUEUE_SIZE = 1024
+    CLOUD_TX_ATTEMPTS = 4
+    CLOUD_TX_RETRY_DELAY_SEC = 1
 
     def __init__(self, config_data: dict, logger: Logger, ev_bus: EventBus, cloud_client: CloudClient, db: Database):
         super().__init__(CartLogic.MYNAME, config_data, logger)
@@ -89,12 +103,34 @@ class CartLogic(AppModuleWithEvents):
         self._prereservation_seconds = 1200
         self._reservation_minutes = 24*60
         self._order_history_minutes = 7*24*60
-        self._reservation_exp_list: list[ExpirationItem] = list()
-        self._exp_list: list[ExpirationItem] = list()
-        self._order_hist_exp_list: list[ExpirationItem] = list()
-        self._pending_dispensing_requests: list[DispensingPendingItem] = list()
-        self._exp_timer = None
-        self._exp_tm_tick_cnt = 0
+        # Expiration timers, type and id of an object mapped to monotonic time when it expires.
+        # Every timer is also pushed to the heap ordered by expiration time, a heap entry which does not match
+        # the timer in the dict (cancelled or restarted timer) is just skipped when popped
+        self._exp_timers: dict[tuple[ExpirationType, int], float] = dict()
+        self._exp_q: list[tuple[float, ExpirationType, int]] = list()
+        # Guards expiration timers, notified when a timer due earlier than all others is set or on stop
+        self._exp_cv = Condition()
+        self._exp_stopped = False
+        self._exp_thread: Thread = Thread(target=self._exp_scheduler)
+        # Handlers of expired objects, get IDs of all objects of the type expired at once
+        self._exp_handlers: dict[ExpirationType, Callable[[list[int]], None]] = {
+            ExpirationType.CART: self._on_carts_expired,
+            ExpirationType.RESERVATION: self._on_reservations_expired,
+            ExpirationType.ORDER_HISTORY: self._on_order_history_expired}
+        self._pending_dispensing_requests: deque[DispensingPendingItem] = deque()
+        # API name and object to be posted to the Cloud by the worker thread, None stops the worker
+        self._cloud_tx_q: Queue[tuple[str, dict] | None] = Queue(maxsize=CartLogic.CLOUD_TX_QUEUE_SIZE)
+        self._cloud_tx_thread: Thread = Thread(target=self._cloud_tx_worker)
+        self._cloud_tx_stopping = ThreadEvent()
+        # Carts looked up by transaction ID, every change of a cart made by this module is reflected here
+        self._carts_by_transaction: dict[str, model.Cart] = dict()
+        # IDs of carts containing a variant, mapped by variant ID, lets planogram updates visit only affected carts
+        self._carts_by_variant: dict[int, set[int]] = dict()
+        # Reverse of the above, IDs of variants in a cart mapped by cart ID
+        self._variants_by_cart: dict[int, set[int]] = dict()
+        # Guards the cart cache and the indexes, they are accessed from REST, event bus, expiration scheduler
+        # and module threads
+        self._carts_lock = Lock()
 
     def _get_my_required_cfg_options(self) -> list:
         return CartLogic.REQ_CFG_OPTIONS
@@ -127,26 +163,42 @@ class CartLogic(AppModuleWithEvents):
         self._ev_bus.subscribe(EventType.PLANOGRAM_UPDATE_DONE, self._app_event_handler)
         self._ev_bus.subscribe(EventType.PURCHASE_FINISHED, self._app_event_handler)
         self._ev_bus.subscribe(EventType.BEGIN_TRANSACTION_REQUEST, self._app_event_handler)
-        self._register_ev_handler(CartEventType.PLANOGRAM_WAS_UPDATED, self._handle_planogram_updated)
-        self._register_ev_handler(CartEventType.PROCESS_PENDING_RESERVATIONS, self._process_pending_reservations)
-        self._register_ev_handler(CartEventType.BEGIN_TRANSACTION, self._begin_transaction)
-        self._register_ev_handler(CartEventType.TRANSACTION_COMPLETED, self._process_transaction_completed)
-        self._register_ev_handler(CartEventType.RESERVATION_REQUEST_UPDATE, self._process_reservation_update)
-        self._register_ev_handler(CartEventType.RESERVATION_REQUEST_CANCEL, self._process_reservation_cancel)
-        self._register_ev_handler(CartEventType.RESERVATION_REQUEST_PROLONG, self._process_reservation_prolong)
-        self._register_ev_handler(CartEventType.RESERVATION_REQUEST_CONFIRM, self._process_reservation_confirm)
+        self._register_ev_handler(CartEventType.PLANOGRAM_WAS_UPDATED, self._handle_planogram_updated,
+                                  ('variants',))
+        self._register_ev_handler(CartEventType.PROCESS_PENDING_RESERVATIONS, self._process_pending_reservations,
+                                  ('item',))
+        self._register_ev_handler(CartEventType.BEGIN_TRANSACTION, self._begin_transaction, ('cart_id',))
+        self._register_ev_handler(CartEventType.TRANSACTION_COMPLETED, self._process_transaction_completed,
+                                  ('transaction_id', 'success'))
+        self._register_ev_handler(CartEventType.RESERVATION_REQUEST_UPDATE, self._process_reservation_update,
+                                  ('transaction_id', 'variant_id', 'amount', 'request_id'))
+        self._register_ev_handler(CartEventType.RESERVATION_REQUEST_CANCEL, self._process_reservation_cancel,
+                                  ('transaction_id',))
+        self._register_ev_handler(CartEventType.RESERVATION_REQUEST_PROLONG, self._process_reservation_prolong,
+                                  ('transaction_id',))
+        self._register_ev_handler(CartEventType.RESERVATION_REQUEST_CONFIRM, self._process_reservation_confirm,
+                                  ('transaction_id', 'pickup_code'))
         self._on_startup()
-        self._exp_timer = Timer(CartLogic.EXP_LIST_CHECK_PERIOD_SEC, self._exp_list_process)
+        self._exp_thread.start()
+        self._cloud_tx_thread.start()
         self._logger.info("Cart Logic module started")
 
     def stop(self):
+        with self._exp_cv:
+            self._exp_stopped = True
+            self._exp_cv.notify()
+        self._exp_thread.join()
         super().stop()
+        # Event processing is stopped, so nothing else is queued for the Cloud
+        self._cloud_tx_stopping.set()
+        self._cloud_tx_q.put(None)
+        self._cloud_tx_thread.join()
         self._logger.info("Cart Logic module stopped")
 
     def _app_event_handler(self, ev: Event):
         """Processes external events"""
         if ev.type == EventType.PLANOGRAM_UPDATE_DONE:
-            self._put_event(CartEventType.PLANOGRAM_WAS_UPDATED, {})
+            self._put_event(CartEventType.PLANOGRAM_WAS_UPDATED, ev.body)
         elif ev.type == EventType.PURCHASE_FINISHED:
             # Not a heavy event, process right away
             self._process_purchase_finished(ev.body)
@@ -163,148 +215,256 @@ class CartLogic(AppModuleWithEvents):
             # - all other carts and their contents should be removed
             carts = self._db.get_carts()
             now = time.time()
+            now_mono = time.monotonic()
+            # Objects created or locked after a cutoff are not expired yet
+            res_cutoff = now - self._reservation_minutes * 60
+            exp_cutoff = now - self._expiration_seconds
+            hist_cutoff = now - self._order_history_minutes * 60
             for cart in carts:
-                passed_sec = now - cart.locked_at
-                passed_min = passed_sec // 60
                 if (cart.cart_type == model.CartType.REMOTE and cart.status == model.CartStatus.RESERVED and
-                        passed_min < self._reservation_minutes):
-                    remained_min = self._reservation_minutes - passed_min
-                    self._reservation_exp_list.append(ExpirationItem(cart.obj_id, time.monotonic() + remained_min * 60))
-                    self._logger.debug(f"Remote cart {cart.obj_id} transaction {cart.transaction_id} added "
-                                       f"to expiration list for {remained_min} minutes")
-                elif cart.status == model.CartStatus.CHECKOUT and passed_sec < self._expiration_seconds:
-                    remained_sec = self._expiration_seconds - passed_sec
-                    self._exp_list.append(ExpirationItem(cart.obj_id, time.monotonic() + remained_sec))
-                    self._logger.debug(f"Local cart {cart.obj_id} display {cart.display_id} transaction "
-                                       f"{cart.transaction_id} added to expiration list for {remained_sec} seconds")
+                        cart.locked_at > res_cutoff):
+                    remained_sec = cart.locked_at - res_cutoff
+                    self._set_exp_timer(ExpirationType.RESERVATION, cart.obj_id, remained_sec, now_mono)
+                    self._index_cart_contents(cart.obj_id)
+                    self._logger.debug("Remote cart %s transaction %s added to expiration list for %s seconds",
+                                       cart.obj_id, cart.transaction_id, remained_sec)
+                elif cart.status == model.CartStatus.CHECKOUT and cart.locked_at > exp_cutoff:
+                    remained_sec = cart.locked_at - exp_cutoff
+                    self._set_exp_timer(ExpirationType.CART, cart.obj_id, remained_sec, now_mono)
+                    self._index_cart_contents(cart.obj_id)
+                    self._logger.debug("Local cart %s display %s transaction %s added to expiration list for %s "
+                                       "seconds", cart.obj_id, cart.display_id, cart.transaction_id, remained_sec)
                 else:
-                    self._db.remove_cart(cart.obj_id)
-                    self._logger.debug(f"Cart {cart.obj_id} display {cart.display_id} transaction "
-                                       f"{cart.transaction_id} is obsolete and cleared")
+                    self._remove_cart(cart)
+                    self._logger.debug("Cart %s display %s transaction %s is obsolete and cleared",
+                                       cart.obj_id, cart.display_id, cart.transaction_id)
             # Check if there are pickup history records in the DB and if yes, then:
             # verify if they are already expired,
             # if not, then add them to the expiration list for the remaining time, otherwise remove them
             records = self._db.get_order_history_records()
             for rec in records:
-                passed_sec = time.time() - rec.created_at
-                passed_min = passed_sec // 60
-                if passed_min < self._order_history_minutes:
-                    remained_min = self._order_history_minutes - passed_min
-                    self._order_hist_exp_list.append(ExpirationItem(rec.obj_id, time.monotonic() + remained_min * 60))
-                    self._logger.debug(f"Order history record {rec.obj_id} transaction {rec.transaction_id} order "
-                                       f"{rec.order_info} added to expiration list for {remained_min} minutes")
+                if rec.created_at > hist_cutoff:
+                    remained_sec = rec.created_at - hist_cutoff
+                    self._set_exp_timer(ExpirationType.ORDER_HISTORY, rec.obj_id, remained_sec, now_mono)
+                    self._logger.debug("Order history record %s transaction %s order %s added to expiration list for "
+                                       "%s seconds", rec.obj_id, rec.transaction_id, rec.order_info, remained_sec)
                 else:
                     self._db.remove_order_history_record(rec.obj_id)
-                    self._logger.debug(f"Order history record {rec.obj_id} transaction {rec.transaction_id} order "
-                                       f"{rec.order_info} is obsolete and removed")
+                    self._logger.debug("Order history record %s transaction %s order %s is obsolete and removed",
+                                       rec.obj_id, rec.transaction_id, rec.order_info)
         except utils.DbError as e:
             # TODO: telemetry
             print(f"{e.funcname}:{e.msg}:{e.internal_error}")
             pass
 
     def _on_transaction_updated(self, msg: str):
-        self._logger.debug(f"Received: ({msg})")
+        self._logger.debug("Received: (%s)", msg)
         try:
             data = json.loads(msg)
             transaction_id = data['transactionId']
             status = data['status']
             self._put_event(CartEventType.TRANSACTION_COMPLETED,
-                            {'transaction_id': transaction_id,
-                             'success': True if status == 'PAYMENT_SUCCESS' else False})
+                            {'transaction_id': transaction_id, 'success': status == 'PAYMENT_SUCCESS'})
         except json.JSONDecodeError as e:
             self._logger.error(f"Failed to process transaction update notification - {str(e)}")
         except KeyError:
             self._logger.warning(f"Received transaction update notification is malformed")
 
     def _on_reservation_updated(self, msg: str):
-        self._logger.debug(f"Received: ({msg})")
+        self._logger.debug("Received: (%s)", msg)
         try:
             data = json.loads(msg)
             transaction_id = data['transactionId']
             upd_type = data['updateType']
+            ev_type = None
+            ev_body = {'transaction_id': transaction_id}
             if upd_type == 'update':
-                self._put_event(CartEventType.RESERVATION_REQUEST_UPDATE, {'transaction_id': transaction_id,
-                                                                           'variant_id': data['variantId'],
-                                                                           'amount': data['amount'],
-                                                                           'request_id': data['requestId']})
+                ev_type = CartEventType.RESERVATION_REQUEST_UPDATE
+                ev_body['variant_id'] = data['variantId']
+                ev_body['amount'] = data['amount']
+                ev_body['request_id'] = data['requestId']
             elif upd_type == 'cancel':
-                self._put_event(CartEventType.RESERVATION_REQUEST_CANCEL, {'transaction_id': transaction_id})
+                ev_type = CartEventType.RESERVATION_REQUEST_CANCEL
             elif upd_type == 'prolong':
-                self._put_event(CartEventType.RESERVATION_REQUEST_PROLONG, {'transaction_id': transaction_id})
+                ev_type = CartEventType.RESERVATION_REQUEST_PROLONG
             elif upd_type == 'confirm':
-                self._put_event(CartEventType.RESERVATION_REQUEST_CONFIRM, {'transaction_id': transaction_id,
-                                                                            'pickup_code': data['pickupCode']})
+                ev_type = CartEventType.RESERVATION_REQUEST_CONFIRM
+                ev_body['pickup_code'] = data['pickupCode']
+            if ev_type is not None:
+                self._put_event(ev_type, ev_body)
         except json.JSONDecodeError as e:
             self._logger.error(f"Failed to process reservation update notification - {str(e)}")
         except KeyError:
             self._logger.warning(f"Received reservation update notification is malformed")
 
-    def _set_prereservation_timer(self, cart_id: int, restart: bool = False):
-        """Add a new prereservation expiration item to the list"""
-        if restart:
-            self._cancel_cart_expiration_tm(cart_id)
-        self._exp_list.append(ExpirationItem(cart_id, time.monotonic() + self._prereservation_seconds))
+    def _set_exp_timer(self, exp_type: ExpirationType, obj_id: int, timeout: float, now: float | None = None):
+        """Sets or restarts expiration timer of the object for the given timeout in seconds.
+           now is the current monotonic time, if the caller already has it.
+        """
+        exp_at = (time.monotonic() if now is None else now) + timeout
+        with self._exp_cv:
+            self._exp_timers[(exp_type, obj_id)] = exp_at
+            heapq.heappush(self._exp_q, (exp_at, exp_type, obj_id))
+            if self._exp_q[0][0] == exp_at:
+                # The scheduler sleeps until a later deadline, wake it up to recalculate
+                self._exp_cv.notify()
+
+    def _cancel_exp_timer(self, exp_type: ExpirationType, obj_id: int):
+        with self._exp_cv:
+            self._exp_timers.pop((exp_type, obj_id), None)
+
+    def _pop_expired(self) -> list[tuple[ExpirationType, int]]:
+        """Removes expired timers and returns types and IDs of corresponding objects"""
+        expired = list()
+        now = time.monotonic()
+        with self._exp_cv:
+            while len(self._exp_q) > 0 and self._exp_q[0][0] <= now:
+                exp_at, exp_type, obj_id = heapq.heappop(self._exp_q)
+                if self._exp_timers.get((exp_type, obj_id)) == exp_at:
+                    del self._exp_timers[(exp_type, obj_id)]
+                    expired.append((exp_type, obj_id))
+        return expired
+
+    def _exp_scheduler(self):
+        """Sleeps until the nearest expiration timer is due and processes expired objects, runs in a separate thread"""
+        while True:
+            with self._exp_cv:
+                while not self._exp_stopped:
+                    if len(self._exp_q) == 0:
+                        self._exp_cv.wait()
+                    else:
+                        timeout = self._exp_q[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self._exp_cv.wait(timeout)
+                if self._exp_stopped:
+                    return
+            self._exp_list_process()
+
+    def _start_prereservation_timer(self, cart_id: int):
+        """Starts prereservation expiration timer of a newly created cart"""
+        self._set_exp_timer(ExpirationType.CART, cart_id, self._prereservation_seconds)
+
+    def _restart_prereservation_timer(self, cart_id: int):
+        """Restarts prereservation expiration timer of the cart, the previous deadline becomes stale"""
+        self._set_exp_timer(ExpirationType.CART, cart_id, self._prereservation_seconds)
 
     def _cancel_cart_expiration_tm(self, cart_id: int):
-        for i in range(len(self._exp_list)):
-            if self._exp_list[i].obj_id == cart_id:
-                del self._exp_list[i]
-                break
+        self._cancel_exp_timer(ExpirationType.CART, cart_id)
 
     def _cancel_cart_reservation_expiration_tm(self, cart_id: int):
-        for i in range(len(self._reservation_exp_list)):
-            if self._reservation_exp_list[i].obj_id == cart_id:
-                del self._reservation_exp_list[i]
-                break
+        self._cancel_exp_timer(ExpirationType.RESERVATION, cart_id)
+
+    def _get_cart_by_transaction(self, transaction_id: str) -> model.Cart | None:
+        """Returns cart for the given transaction ID from the cache, loads it from the DB if it is not cached yet"""
+        with self._carts_lock:
+            cart = self._carts_by_transaction.get(transaction_id)
+        if cart is None:
+            cart = self._db.get_cart_by_transaction(transaction_id)
+            if cart is not None:
+                # Another thread might have cached the cart meanwhile, then its instance is used
+                with self._carts_lock:
+                    cart = self._carts_by_transaction.setdefault(transaction_id, cart)
+        return cart
+
+    def _uncache_cart(self, transaction_id: str):
+        with self._carts_lock:
+            self._carts_by_transaction.pop(transaction_id, None)
+
+    def _update_cart(self, cart: model.Cart):
+        try:
+            self._db.update_cart(cart)
+        except utils.DbError:
+            # Cached cart might be already modified and does not match the DB anymore
+            self._uncache_cart(cart.transaction_id)
+            raise
+
+    def _remove_cart(self, cart: model.Cart):
+        self._forget_cart(cart)
+        self._db.remove_cart(cart.obj_id)
+
+    def _forget_cart(self, cart: model.Cart):
+        """Drops the cart from the caches and indexes of the module"""
+        with self._carts_lock:
+            self._carts_by_transaction.pop(cart.transaction_id, None)
+            for var_id in self._variants_by_cart.pop(cart.obj_id, ()):
+                self._discard_from_variant_index(var_id, cart.obj_id)
+
+    def _index_cart_contents(self, cart_id: int):
+        items = self._db.get_cart_items(cart_id)
+        with self._carts_lock:
+            for item in items:
+                self._carts_by_variant.setdefault(item.variant_id, set()).add(cart_id)
+                self._variants_by_cart.setdefault(cart_id, set()).add(item.variant_id)
+
+    def _index_cart_item(self, cart_id: int, var_id: int):
+        with self._carts_lock:
+            self._carts_by_variant.setdefault(var_id, set()).add(cart_id)
+            self._variants_by_cart.setdefault(cart_id, set()).add(var_id)
+
+    def _unindex_cart_item(self, cart_id: int, var_id: int):
+        with self._carts_lock:
+            var_ids = self._variants_by_cart.get(cart_id)
+            if var_ids is not None:
+                var_ids.discard(var_id)
+                if not var_ids:
+                    del self._variants_by_cart[cart_id]
+            self._discard_from_variant_index(var_id, cart_id)
+
+    def _discard_from_variant_index(self, var_id: int, cart_id: int):
+        """Must be called with _carts_lock held"""
+        cart_ids = self._carts_by_variant.get(var_id)
+        if cart_ids is not None:
+            cart_ids.discard(cart_id)
+            if not cart_ids:
+                del self._carts_by_variant[var_id]
 
     def _do_reservation(self, cart_id: int, var_id: int, amount: int) -> bool:
         """Tries to reserve amount of var_id items if this amount is available.
            Returns true in case of success and False otherwise.
         """
-        quantity = 0
-        inv_items = self._db.get_inventory_items_by_variant(var_id)
-        for item in inv_items:
-            quantity += item.quantity
-        reserved = 0
-        reservations = self._db.get_reservations(var_id)
-        for r in reservations:
-            reserved += r.quantity
+        quantity, reserved = self._db.get_available_quantity(var_id)
         if quantity > 0 and (quantity - reserved) >= amount:
+            inv_items = self._db.get_inventory_items_by_variant(var_id)
+            # Reserved quantity per (unit_id, location)
+            reserved_by_loc: dict[tuple[int, int], int] = defaultdict(int)
+            for r in self._db.get_reservations(var_id):
+                reserved_by_loc[(r.unit_id, r.location)] += r.quantity
+            # Reservations are collected first and written to the DB in one transaction
+            new_reservations = list()
             for item in inv_items:
-                already_reserved = 0
-                for r in reservations:
-                    if item.unit_id == r.unit_id and item.location == r.location:
-                        already_reserved += r.quantity
+                already_reserved = reserved_by_loc[(item.unit_id, item.location)]
                 if (item.quantity - already_reserved) >= amount:
-                    self._db.add_or_update_reservation(model.Reservation(0, cart_id, var_id, item.unit_id,
-                                                                         item.location, amount))
+                    new_reservations.append(model.Reservation(0, cart_id, var_id, item.unit_id, item.location, amount))
                     break
                 elif item.quantity == already_reserved:
                     continue
                 else:
-                    self._db.add_or_update_reservation(model.Reservation(0, cart_id, var_id, item.unit_id,
-                                                                         item.location,
-                                                                         item.quantity - already_reserved))
+                    new_reservations.append(model.Reservation(0, cart_id, var_id, item.unit_id, item.location,
+                                                              item.quantity - already_reserved))
                     amount -= item.quantity - already_reserved
                     continue
+            self._db.apply_reservation_batch(added=new_reservations)
             return True
         return False
 
     def _cancel_reservation(self, cart_id: int, var_id: int, amount: int):
         reservations = self._db.get_reservations(var_id, cart_id)
+        updated = list()
+        removed = list()
         for r in reservations:
             if r.quantity == amount:
-                self._db.remove_reservation(r.id)
+                removed.append(r.id)
                 break
             elif r.quantity < amount:
-                self._db.remove_reservation(r.id)
+                removed.append(r.id)
                 amount -= r.quantity
             else:
-                r.quantity -= amount
-                self._db.update_reservation(r)
+                updated.append(r._replace(quantity=r.quantity - amount))
                 break
             if amount <= 0:
                 break
+        self._db.apply_reservation_batch(updated=updated, removed=removed)
 
     def update(self, transaction_id: str, display_id: int, cart_type: model.CartType, var_id: int,
                amount: int) -> (CartOperationResult, str):
@@ -312,12 +472,12 @@ class CartLogic(AppModuleWithEvents):
             by the given amount or creates new reservations.
         """
         try:
-            self._logger.debug(f"Handling cart update for transaction {transaction_id}")
+            self._logger.debug("Handling cart update for transaction %s", transaction_id)
             if amount == 0:
                 self._logger.warning("Requested cart update with zero amount")
                 return CartOperationResult.ERROR, "Amount cannot be 0"
             is_new_cart = False
-            cart = self._db.get_cart_by_transaction(transaction_id)
+            cart = self._get_cart_by_transaction(transaction_id)
             if cart is None:
                 cart = model.Cart(0, display_id, transaction_id, int(cart_type), '',
                                   int(model.CartStatus.CREATED) if cart_type == model.CartType.LOCAL else
@@ -325,42 +485,45 @@ class CartLogic(AppModuleWithEvents):
                 cart.obj_id = self._db.add_cart(cart)
                 is_new_cart = True
                 if cart.status == model.CartStatus.PRERESERVATION:
-                    self._set_prereservation_timer(cart.obj_id)
+                    self._start_prereservation_timer(cart.obj_id)
             cart_contents = self._db.get_cart_items(cart.obj_id)
             is_processed = False
             result = (CartOperationResult.OK, "")
             for item in cart_contents:
                 if item.variant_id == var_id:
+                    cur_amount = item.amount
                     if amount > 0:
                         if self._do_reservation(cart.obj_id, var_id, amount):
-                            item.amount += amount
-                            self._db.update_cart_item(item)
-                            self._logger.debug(f"Increased number of items in the cart of {var_id} by {amount}")
+                            self._db.update_cart_item(item._replace(amount=cur_amount + amount))
+                            self._logger.debug("Increased number of items in the cart of %s by %s", var_id, amount)
                         else:
                             self._logger.warning("Failed to increase number of items in the cart of "
                                                  f"{var_id} by {amount}")
                             result = (CartOperationResult.NOK, "")
                     else:
-                        abs_amount = abs(amount)
-                        if item.amount >= abs_amount:
+                        abs_amount = -amount
+                        if cur_amount >= abs_amount:
                             self._cancel_reservation(cart.obj_id, var_id, abs_amount)
-                            if (item.amount - abs_amount) > 0:
-                                item.amount -= abs_amount
-                                self._db.update_cart_item(item)
+                            if cur_amount > abs_amount:
+                                self._db.update_cart_item(item._replace(amount=cur_amount - abs_amount))
                             else:
                                 self._db.remove_cart_item(item)
-                            self._logger.debug(f"Decreased number of items in the cart of {var_id} by {abs_amount}")
+                                self._unindex_cart_item(cart.obj_id, var_id)
+                            self._logger.debug("Decreased number of items in the cart of %s by %s", var_id, abs_amount)
                         else:
                             self._logger.warning(f"Requested to remove from cart {cart.obj_id} more items of "
                                                  f"{var_id} than it contains")
                             result = (CartOperationResult.ERROR, f"Requested amount {abs_amount} is more than reserved")
+                    # A variant is present in the cart contents only once
                     is_processed = True
+                    break
             if not is_processed:
                 if amount > 0:
                     if self._do_reservation(cart.obj_id, var_id, amount):
                         item = model.CartItem(cart.obj_id, var_id, amount)
                         self._db.add_cart_item(item)
-                        self._logger.debug(f"Added {amount} of {var_id} to the cart")
+                        self._index_cart_item(cart.obj_id, var_id)
+                        self._logger.debug("Added %s of %s to the cart", amount, var_id)
                     else:
                         self._logger.warning(f"Failed to add {amount} of {var_id} to the cart")
                         result = (CartOperationResult.NOK, "")
@@ -369,7 +532,7 @@ class CartLogic(AppModuleWithEvents):
                     result = (CartOperationResult.ERROR, "Cannot remove not yet added items")
             if (not is_new_cart and cart.status == model.CartStatus.PRERESERVATION
                     and result[0] == CartOperationResult.OK):
-                self._set_prereservation_timer(cart.obj_id, restart=True)
+                self._restart_prereservation_timer(cart.obj_id)
             return result
         except utils.DbError as e:
             # TODO: telemetry
@@ -378,15 +541,15 @@ class CartLogic(AppModuleWithEvents):
     def clear(self, transaction_id: str) -> (CartOperationResult, str):
         """Clears cart, its contents and connected reservations. Aborts all expiration timeouts."""
         try:
-            self._logger.debug(f"Handling cart clear for transaction {transaction_id}")
-            cart = self._db.get_cart_by_transaction(transaction_id)
+            self._logger.debug("Handling cart clear for transaction %s", transaction_id)
+            cart = self._get_cart_by_transaction(transaction_id)
             if cart is None:
                 self._logger.warning(f"Trying to clear cart for transaction {transaction_id} but it does not exist")
                 return CartOperationResult.ERROR, "Cart is not found"
             self._cancel_cart_expiration_tm(cart.obj_id)
             if cart.cart_type == model.CartType.REMOTE:
                 self._cancel_cart_reservation_expiration_tm(cart.obj_id)
-            self._db.remove_cart(cart.obj_id)
+            self._remove_cart(cart)
             return CartOperationResult.OK, ""
         except utils.DbError as e:
             # TODO: telemetry
@@ -395,13 +558,13 @@ class CartLogic(AppModuleWithEvents):
     def prolong(self, transaction_id: str) -> (CartOperationResult, str):
         """Used by the Online Shopping portal to prolong prereservation of a remote cart"""
         try:
-            self._logger.debug(f"Handling cart prolong for transaction {transaction_id}")
-            cart = self._db.get_cart_by_transaction(transaction_id)
+            self._logger.debug("Handling cart prolong for transaction %s", transaction_id)
+            cart = self._get_cart_by_transaction(transaction_id)
             if cart is None:
                 self._logger.warning(f"Trying to prolong cart for transaction {transaction_id} but it does not exist")
                 return CartOperationResult.ERROR, "Cart is not found"
             if cart.cart_type == model.CartType.REMOTE and cart.status == model.CartStatus.PRERESERVATION:
-                self._set_prereservation_timer(cart.obj_id, restart=True)
+                self._restart_prereservation_timer(cart.obj_id)
             else:
                 self._logger.warning(f"Trying to prolong cart {cart.obj_id} for transaction {transaction_id}, "
                                      "but either it is not remote or its state is incorrect")
@@ -414,10 +577,10 @@ class CartLogic(AppModuleWithEvents):
     def reserve(self, transaction_id: str, order_info: str) -> (CartOperationResult, str):
         """Used by the Online Shopping portal to reserve a cart for subsequent pick up"""
         try:
-            self._logger.debug(f"Handling cart reserve for transaction {transaction_id}")
-            cart = self._db.get_cart_by_transaction(transaction_id)
+            self._logger.debug("Handling cart reserve for transaction %s", transaction_id)
+            cart = self._get_cart_by_transaction(transaction_id)
             if cart is None:
-                self._logger.info(f"Trying to reserve cart for transaction {transaction_id} but it does not exist")
+                self._logger.info("Trying to reserve cart for transaction %s but it does not exist", transaction_id)
                 return CartOperationResult.ERROR, "Cart is not found"
             if cart.cart_type == model.CartType.REMOTE:
                 self._cancel_cart_expiration_tm(cart.obj_id)
@@ -425,9 +588,8 @@ class CartLogic(AppModuleWithEvents):
                 cart.checkout_method = model.CheckoutMethod.PICKUP
                 cart.status = model.CartStatus.RESERVED
                 cart.locked_at = time.time()
-                self._db.update_cart(cart)
-                self._reservation_exp_list.append(ExpirationItem(cart.obj_id,
-                                                                 time.monotonic() + self._reservation_minutes * 60))
+                self._update_cart(cart)
+                self._set_exp_timer(ExpirationType.RESERVATION, cart.obj_id, self._reservation_minutes * 60)
             else:
                 self._logger.warning(f"Trying to reserve cart {cart.obj_id} for transaction {transaction_id}, "
                                      "but it is not remote")
@@ -440,8 +602,8 @@ class CartLogic(AppModuleWithEvents):
     def dispense(self, transaction_id: str, display_id: int = 0) -> (CartOperationResult, str):
         """Initiate dispensing process for the cart with the given transaction ID"""
         try:
-            self._logger.debug(f"Handling cart dispense for transaction {transaction_id}")
-            cart = self._db.get_cart_by_transaction(transaction_id)
+            self._logger.debug("Handling cart dispense for transaction %s", transaction_id)
+            cart = self._get_cart_by_transaction(transaction_id)
             if cart is None:
                 self._logger.warning(f"Trying to start dispensing of cart for transaction {transaction_id} "
                                      "but it does not exist")
@@ -456,15 +618,12 @@ class CartLogic(AppModuleWithEvents):
                 self._cancel_cart_reservation_expiration_tm(cart.obj_id)
                 # Set display_id in cart to be used to show dispensing progress
                 cart.display_id = display_id
-                self._db.update_cart(cart)
-            reservations = list()
-            for item in cart_contents:
-                var_reservations = self._db.get_reservations(item.variant_id, cart.obj_id)
-                reservations = reservations + var_reservations
+                self._update_cart(cart)
+            reservations = self._db.get_reservations_by_cart(cart.obj_id)
             # TODO: Call dispensing logic module to start dispensing of reservations
             # if start dispensing
             #    cart.status = model.CartStatus.DISPENSING
-            #    self._db.update_cart(cart)
+            #    self._update_cart(cart)
             # else:
             #    self._logger.into(f"Cannot start dispensing for cart {cart.obj_id} transaction {transaction_id} "
             #                      f"order {cart.order_info}, put to the queue")
@@ -479,42 +638,44 @@ class CartLogic(AppModuleWithEvents):
         """Check if there are reserved variants and if their locations were changed due to planogram update.
            If yes, then update reservations accordingly.
         """
-        var_locations: dict[dict[list]] = dict()
         try:
-            carts = self._db.get_carts()
-            for cart in carts:
-                cart_contents = self._db.get_cart_items(cart.obj_id)
-                for item in cart_contents:
-                    var_id = item.variant_id
-                    inv_items = self._db.get_inventory_items_by_variant(var_id)
-                    if var_id not in var_locations:
-                        var_locations[var_id] = dict()
-                        for inv_item in inv_items:
-                            if inv_item.unit_id in var_locations[var_id]:
-                                var_locations[var_id][inv_item.unit_id].append(inv_item.location)
-                            else:
-                                var_locations[var_id][inv_item.unit_id] = list()
-                                var_locations[var_id][inv_item.unit_id].append(inv_item.location)
+            # Relocated reservations are written to the DB in one transaction after all variants are processed
+            relocated = list()
+            for var_id in params['variants']:
+                # Copied as the index might be changed by cart updates from other threads
+                with self._carts_lock:
+                    cart_ids = tuple(self._carts_by_variant.get(var_id, ()))
+                if not cart_ids:
+                    continue
+                # Locations of the variant after update, mapped by unit ID
+                unit_locations: dict[int, set[int]] = defaultdict(set)
+                for inv_item in self._db.get_inventory_items_by_variant(var_id):
+                    unit_locations[inv_item.unit_id].add(inv_item.location)
+                for cart_id in cart_ids:
+                    cart = self._db.get_cart(cart_id)
+                    if cart is None:
+                        continue
                     reservations = self._db.get_reservations(var_id, cart.obj_id)
-                    used_locations = list()
+                    used_locations = set()
                     # First pass, lookup for not changed locations
                     for r in reservations:
-                        if r.unit_id not in var_locations[var_id]:
+                        if r.unit_id not in unit_locations:
                             # Should not happen
                             self._logger.critical("Reservations and Inventory are out of sync. Reserved item of "
                                                   f"{var_id} is expected to be in unit {r.unit_id}, but not found")
                             # TODO: telemetry
                         else:
-                            if r.location in var_locations[var_id][r.unit_id]:
+                            if r.location in unit_locations[r.unit_id]:
                                 # Assume that reservations for one cart are all in the same unit.
                                 # If a location was not changed that it cannot be a target for other, changed locations.
-                                used_locations.append(r.location)
+                                used_locations.add(r.location)
                     # Second pass, update changed locations
                     for r in reservations:
-                        if r.location not in var_locations[var_id][r.unit_id]:
+                        locations = unit_locations[r.unit_id]
+                        if r.location not in locations:
                             # Variant was moved from this location, need to find another one
                             updated = False
-                            for loc in var_locations[var_id][r.unit_id]:
+                            for loc in locations:
                                 if loc not in used_locations:
                                     # Assume that after planogram update all variants used in reservations
                                     # occupy not less slots within one unit than before update.
@@ -522,106 +683,92 @@ class CartLogic(AppModuleWithEvents):
                                     # it cannot be assigned more (within the cart).
                                     # Also assume that after update enough amount of products are in new slots
                                     # to let the reserved items be dispensed later on. We cannot control it in SW
-                                    self._db.update_reservation(r, loc)
-                                    used_locations.append(loc)
+                                    relocated.append(r._replace(location=loc))
+                                    used_locations.add(loc)
                                     updated = True
-                                    self._logger.debug(f"Reserved variant {var_id} in cart {cart.obj_id} transaction "
-                                                       f"{cart.transaction_id} in unit {r.unit_id} changed location "
-                                                       f"from {r.location} to {loc}")
+                                    self._logger.debug("Reserved variant %s in cart %s transaction %s in unit %s "
+                                                       "changed location from %s to %s", var_id, cart.obj_id,
+                                                       cart.transaction_id, r.unit_id, r.location, loc)
                                     break
                             if not updated:
                                 self._logger.critical(f"Failed to relocate reserved variant {var_id} in unit "
                                                       f"{r.unit_id} location {r.location}")
                                 # TODO: telemetry
-        except KeyError as e:
-            self._logger.error(f"Data structure error occurred while trying to relocate reserved items - {str(e)}")
-            # TODO: telemetry
+            if len(relocated) > 0:
+                self._db.apply_reservation_batch(updated=relocated)
         except utils.DbError as e:
             # TODO: telemetry
             pass
 
     def _exp_list_process(self):
-        """Walk through the expiration lists, check if an item is expired and process it"""
-        try:
-            # First part, short timers
-            items_to_erase = list()
-            for exp_item in self._exp_list:
-                if time.monotonic() > exp_item.exp_at:
-                    cart = self._db.get_cart(exp_item.obj_id)
-                    if cart is None:
-                        self._logger.warning(f"Cart {exp_item.obj_id} is expired but failed to find it in DB")
-                    else:
-                        if cart.status == model.CartStatus.PRERESERVATION:
-                            self._ev_bus.post(Event(EventType.RESERVATION_COMPLETED,
-                                                    {'transaction_id': cart.transaction_id,
-                                                     'status': model.ReservationCompletionStatus.EXPIRED}))
-                        self._db.remove_cart(cart.obj_id)
-                        self._logger.debug(f"Cart {cart.obj_id} display {cart.display_id} transaction "
-                                           f"{cart.transaction_id} is expired and cleared")
-                    items_to_erase.append(exp_item)
-            for item in items_to_erase:
-                self._exp_list.remove(item)
-            # Second part, long timers
-            self._exp_tm_tick_cnt += 1
-            if self._exp_tm_tick_cnt >= CartLogic.EXP_TM_TICKS_IN_MINUTE:
-                self._exp_tm_tick_cnt = 0
-                items_to_erase.clear()
-                for exp_item in self._reservation_exp_list:
-                    if time.monotonic() > exp_item.exp_at:
-                        cart = self._db.get_cart(exp_item.obj_id)
-                        if cart is None:
-                            self._logger.warning(f"Remote cart {exp_item.obj_id} is expired "
-                                                 "but failed to find it in DB")
-                        else:
-                            self._ev_bus.post(Event(EventType.RESERVATION_COMPLETED,
-                                                    {'transaction_id': cart.transaction_id,
-                                                     'status': model.ReservationCompletionStatus.EXPIRED}))
-                            order_hist_rec = model.OrderHistoryRecord(0, cart.transaction_id, cart.order_info,
-                                                                      model.ReservationCompletionStatus.EXPIRED,
-                                                                      time.time())
-                            order_hist_rec.obj_id = self._db.add_order_history_record(order_hist_rec)
-                            self._order_hist_exp_list.append(ExpirationItem(order_hist_rec.obj_id, time.monotonic() +
-                                                                            self._order_history_minutes * 60))
-                            self._db.remove_cart(cart.obj_id)
-                            self._logger.debug(f"Remote cart {cart.obj_id} transaction {cart.transaction_id}"
-                                               " is expired and cleared")
-                        items_to_erase.append(exp_item)
-                for item in items_to_erase:
-                    self._reservation_exp_list.remove(item)
-                items_to_erase.clear()
-                for exp_item in self._order_hist_exp_list:
-                    if time.monotonic() > exp_item.exp_at:
-                        self._db.remove_order_history_record(exp_item.obj_id)
-                        self._logger.debug(f"Order history record {exp_item.obj_id} is expired and cleared")
-                        items_to_erase.append(exp_item)
-                for item in items_to_erase:
-                    self._order_hist_exp_list.remove(item)
-        except utils.DbError as e:
-            # TODO: telemetry
-            pass
-        finally:
-            self._exp_timer = Timer(CartLogic.EXP_LIST_CHECK_PERIOD_SEC, self._exp_list_process)
+        """Pop expired timers and process the corresponding objects, all objects of one type at once"""
+        expired: dict[ExpirationType, list[int]] = defaultdict(list)
+        for exp_type, obj_id in self._pop_expired():
+            expired[exp_type].append(obj_id)
+        for exp_type, obj_ids in expired.items():
+            try:
+                self._exp_handlers[exp_type](obj_ids)
+            except utils.DbError as e:
+                # TODO: telemetry
+                pass
+
+    def _on_order_history_expired(self, rec_ids: list[int]):
+        self._db.remove_order_history_records(rec_ids)
+        self._logger.debug("Order history records %s are expired and cleared", rec_ids)
+
+    def _get_expired_carts(self, cart_ids: list[int]) -> list[model.Cart]:
+        carts = self._db.get_carts_by_ids(cart_ids)
+        if len(carts) != len(cart_ids):
+            found_ids = {cart.obj_id for cart in carts}
+            self._logger.warning(f"Carts {[i for i in cart_ids if i not in found_ids]} are expired "
+                                 "but failed to find them in DB")
+        return carts
+
+    def _on_carts_expired(self, cart_ids: list[int]):
+        for cart in self._get_expired_carts(cart_ids):
+            if cart.status == model.CartStatus.PRERESERVATION:
+                self._ev_bus.post(Event(EventType.RESERVATION_COMPLETED,
+                                        {'transaction_id': cart.transaction_id, 'status': _STATUS_EXPIRED}))
+            self._remove_cart(cart)
+            self._logger.debug("Cart %s display %s transaction %s is expired and cleared",
+                               cart.obj_id, cart.display_id, cart.transaction_id)
+
+    def _on_reservations_expired(self, cart_ids: list[int]):
+        carts = self._get_expired_carts(cart_ids)
+        if len(carts) == 0:
+            return
+        now = time.time()
+        records = [model.OrderHistoryRecord(0, cart.transaction_id, cart.order_info, _STATUS_EXPIRED, now)
+                   for cart in carts]
+        # All expired carts are moved to the order history in one transaction, events are posted once it is committed
+        rec_ids = self._db.replace_carts_with_order_history([cart.obj_id for cart in carts], records)
+        for cart, rec_id in zip(carts, rec_ids):
+            self._forget_cart(cart)
+            self._set_exp_timer(ExpirationType.ORDER_HISTORY, rec_id, self._order_history_minutes * 60)
+            self._ev_bus.post(Event(EventType.RESERVATION_COMPLETED,
+                                    {'transaction_id': cart.transaction_id, 'status': _STATUS_EXPIRED}))
+            self._logger.debug("Remote cart %s transaction %s is expired and cleared",
+                               cart.obj_id, cart.transaction_id)
 
     def _process_purchase_finished(self, params: dict):
         try:
-            self._logger.debug(f"Process purchase complete event for cart {params['cart_id']}")
+            self._logger.debug("Process purchase complete event for cart %s", params['cart_id'])
             cart = self._db.get_cart(params['cart_id'])
             if cart is None:
                 self._logger.warning(f"Purchase is complete but failed to find the cart for id {params['cart_id']}")
             else:
                 if cart.cart_type == model.CartType.REMOTE:
                     self._ev_bus.post(Event(EventType.RESERVATION_COMPLETED,
-                                            model.ReservationCompletionStatus.DISPENSED))
+                                            {'transaction_id': cart.transaction_id, 'status': _STATUS_DISPENSED}))
                     order_hist_rec = model.OrderHistoryRecord(0, cart.transaction_id, cart.order_info,
-                                                              model.ReservationCompletionStatus.DISPENSED,
-                                                              time.time())
+                                                              _STATUS_DISPENSED, time.time())
                     order_hist_rec.obj_id = self._db.add_order_history_record(order_hist_rec)
-                    self._order_hist_exp_list.append(ExpirationItem(order_hist_rec.obj_id, time.monotonic() +
-                                                                    self._order_history_minutes * 60))
-                self._db.remove_cart(cart.obj_id)
+                    self._set_exp_timer(ExpirationType.ORDER_HISTORY, order_hist_rec.obj_id,
+                                        self._order_history_minutes * 60)
+                self._remove_cart(cart)
             # Check if there are pending dispensing requests and generate an event to process the first one
-            if len(self._pending_dispensing_requests) > 0:
-                pending_item = self._pending_dispensing_requests.pop(0)
+            if self._pending_dispensing_requests:
+                pending_item = self._pending_dispensing_requests.popleft()
                 self._put_event(CartEventType.PROCESS_PENDING_RESERVATIONS, {'item': pending_item})
         except KeyError as e:
             self._logger.error(f"Failed to access data structures - {str(e)}")
@@ -633,7 +780,7 @@ class CartLogic(AppModuleWithEvents):
         """Try to initiate dispensing again for the pending reservations"""
         try:
             pending_item = params['item']
-            self._logger.debug(f"Process pending reservations for cart {pending_item.cart_id}")
+            self._logger.debug("Process pending reservations for cart %s", pending_item.cart_id)
             cart = self._db.get_cart(pending_item.cart_id)
             if cart is None:
                 # Should not happen
@@ -643,14 +790,12 @@ class CartLogic(AppModuleWithEvents):
             # TODO: Call dispensing logic module to start dispensing of reservations
             # if start dispensing
             #    cart.status = model.CartStatus.DISPENSING
-            #    self._db.update_cart(cart)
+            #    self._update_cart(cart)
             # else:
             # Maybe good to have a mechanism to limit number of attempts to dispense same reservations
             #    self._logger.into(f"Cannot start dispensing for pending cart {cart.obj_id} transaction "
             #                      f"{transaction_id} order {cart.order_info}, put to the queue again")
             #    self._pending_dispensing_requests.append(pending_item)
-        except KeyError as e:
-            self._logger.error(f"Failed to access input parameter - {str(e)}")
         except utils.DbError as e:
             # TODO: telemetry
             pass
@@ -660,11 +805,7 @@ class CartLogic(AppModuleWithEvents):
            expecting to get transaction ID back. Broadcasts the got transaction ID using event bus.
         """
         is_ok = False
-        try:
-            cart_id = params['cart_id']
-        except KeyError as e:
-            self._logger.error(f"Failed to access input parameter - {str(e)}")
-            return
+        cart_id = params['cart_id']
         try:
             cart = self._db.get_cart(cart_id)
             if cart is None:
@@ -678,28 +819,18 @@ class CartLogic(AppModuleWithEvents):
                 self._logger.error(f"Trying to begin transaction for cart {cart_id} but it is empty")
                 self._ev_bus.post(Event(EventType.BEGIN_TRANSACTION_RESPONSE, {'cart_id': cart_id, 'success': False}))
                 return
-            req = {'deviceId': '', 'products': []}
-            for item in cart_contents:
-                req['products'].append({'id': item.variant_id, 'qty': item.amount})
+            req = {'deviceId': '', 'products': [{'id': item.variant_id, 'qty': item.amount} for item in cart_contents]}
             res = self._cloud_client.invoke_api_post_with_response('transaction', req)
+            self._uncache_cart(cart.transaction_id)
             cart.transaction_id = res['transactionId']
             cart.status = model.CartStatus.CHECKOUT
             cart.locked_at = time.time()
-            self._db.update_cart(cart)
-            self._exp_list.append(ExpirationItem(cart_id, time.monotonic() + self._expiration_seconds))
+            self._update_cart(cart)
+            self._set_exp_timer(ExpirationType.CART, cart_id, self._expiration_seconds)
             is_ok = True
             self._ev_bus.post(Event(EventType.BEGIN_TRANSACTION_RESPONSE, {'cart_id': cart_id, 'success': True}))
-        except utils.CloudApiNotFound:
-            self._logger.error("{POST API for transaction is not found in the Cloud client")
-        except utils.CloudApiFormatError as e:
-            self._logger.error(f"POST API for transaction returned malformed response - {e.msg}")
-        except utils.CloudApiServerError as e:
-            self._logger.error(f"Failed to post transaction data to the Cloud, server returned: code {e.status_code}, "
-                               f"message ({e.response})")
-        except utils.CloudApiConnectionError as e:
-            self._logger.error(f"Failed to connect to the Cloud to post transaction data - {e.msg}")
-        except utils.CloudApiTimeoutError:
-            self._logger.error("Failed to post transaction data to the Cloud due to timeout")
+        except utils.CloudApiError as e:
+            self._logger.error(f"Failed to post transaction data to the Cloud, {e.log_message()}")
         except KeyError as e:
             self._logger.error(f"Received initiate transaction response is malformed - {str(e)}")
         except utils.DbError as e:
@@ -710,56 +841,60 @@ class CartLogic(AppModuleWithEvents):
                 self._ev_bus.post(Event(EventType.BEGIN_TRANSACTION_RESPONSE, {'cart_id': cart_id, 'success': False}))
 
     def _process_transaction_completed(self, params: dict):
-        try:
-            transaction_id = params['transaction_id']
-            if params['success']:
-                self.dispense(transaction_id)
-            else:
-                self.clear(transaction_id)
-        except KeyError as e:
-            self._logger.error(f"Failed to access input parameter - {str(e)}")
+        if params['success']:
+            self.dispense(params['transaction_id'])
+        else:
+            self.clear(params['transaction_id'])
 
     def _process_reservation_update(self, params: dict):
         """Processes reservation request from the Online Shopping portal.
            Tries to update the remote cart and sends the result back to the cloud using the corresponding API
         """
-        try:
-            transaction_id = params['transaction_id']
-            variant_id = params['variant_id']
-            amount = params['amount']
-            request_id = params['request_id']
-        except KeyError as e:
-            self._logger.error(f"Failed to access input parameter - {str(e)}")
-            return
+        transaction_id = params['transaction_id']
+        variant_id = params['variant_id']
+        amount = params['amount']
+        request_id = params['request_id']
         res,_ = self.update(transaction_id, 0, model.CartType.REMOTE, variant_id, amount)
+        resp = {'deviceId': '', 'transactionId': transaction_id,
+                'requestId': request_id, 'result': res == CartOperationResult.OK}
+        self._post_to_cloud('prereservation', resp)
+
+    def _post_to_cloud(self, api_name: str, obj: dict):
+        """Queues the object to be posted to the Cloud by the worker thread, does not wait for the result"""
         try:
-            resp = {'deviceId': '', 'transactionId': transaction_id,
-                    'requestId': request_id, 'result': True if res == CartOperationResult.OK else False}
-            self._cloud_client.invoke_api_post('prereservation', resp)
-        except utils.CloudApiNotFound:
-            self._logger.error("{POST API for prereservation is not found in the Cloud client")
-        except utils.CloudApiServerError as e:
-            self._logger.error(f"Failed to post preservation response data to the Cloud, server returned: code "
-                               f"{e.status_code}, message ({e.response})")
-        except utils.CloudApiConnectionError as e:
-            self._logger.error(f"Failed to connect to the Cloud to post prereservation response data - {e.msg}")
-        except utils.CloudApiTimeoutError:
-            self._logger.error("Failed to post prereservation response data to the Cloud due to timeout")
+            self._cloud_tx_q.put_nowait((api_name, obj))
+        except Full:
+            self._logger.error(f"Cloud transmit queue is full, {api_name} data is dropped")
+
+    def _cloud_tx_worker(self):
+        """Posts queued objects to the Cloud, retries with increasing delay if the Cloud is unreachable"""
+        while True:
+            item = self._cloud_tx_q.get()
+            if item is None:
+                break
+            api_name, obj = item
+            delay = CartLogic.CLOUD_TX_RETRY_DELAY_SEC
+            for attempt in range(1, CartLogic.CLOUD_TX_ATTEMPTS + 1):
+                try:
+                    self._cloud_client.invoke_api_post(api_name, obj)
+                    break
+                except (utils.CloudApiConnectionError, utils.CloudApiTimeoutError) as e:
+                    if attempt == CartLogic.CLOUD_TX_ATTEMPTS:
+                        self._logger.error(f"Failed to post {api_name} data to the Cloud after {attempt} attempts, "
+                                           f"{e.log_message()}")
+                    elif self._cloud_tx_stopping.wait(delay):
+                        self._logger.error(f"Posting of {api_name} data to the Cloud is aborted on stop")
+                        break
+                    delay *= 2
+                except utils.CloudApiError as e:
+                    self._logger.error(f"Failed to post {api_name} data to the Cloud, {e.log_message()}")
+                    break
 
     def _process_reservation_cancel(self, params: dict):
-        try:
-            self.clear(params['transaction_id'])
-        except KeyError as e:
-            self._logger.error(f"Failed to access input parameter - {str(e)}")
+        self.clear(params['transaction_id'])
 
     def _process_reservation_prolong(self, params: dict):
-        try:
-            self.prolong(params['transaction_id'])
-        except KeyError as e:
-            self._logger.error(f"Failed to access input parameter - {str(e)}")
+        self.prolong(params['transaction_id'])
 
     def _process_reservation_confirm(self, params: dict):
-        try:
-            self.reserve(params['transaction_id'], params['pickup_code'])
-        except KeyError as e:
-            self._logger.error(f"Failed to access input parameter - {str(e)}")
+        self.reserve(params['transaction_id'], params['pickup_code'])
@@ -27,6 +27,14 @@ class MachineEventType(AppModuleEventType):
 #
 
 
+# Machine condition flags, bits of MachineLogic._flags
+F_PLANOGRAM_SET = 1
+F_DISPENSER_READY = 2
+F_DOOR_OPEN = 4
+F_HW_ERROR = 8
+F_DISPENSING = 16
+
+
 class MachineLogic(AppModuleWithEvents):
     """Implements logic related to machine management.
     """
@@ -38,16 +46,16 @@ class MachineLogic(AppModuleWithEvents):
         self._ev_bus = ev_bus
         self._planogram_logic = planogram_logic
         self._fsm = FSM(logger)
-        self._dispenser_is_ready = False
-        self._is_door_open = False
-        self._is_hw_error_indicated = False
-        self._is_dispensing_in_progress = False
+        # Combination of F_* condition flags, the FSM is run only if they changed since its last run
+        self._flags = 0
+        self._fsm_run_flags = -1
 
     def _get_my_required_cfg_options(self) -> list:
         return MachineLogic.REQ_CFG_OPTIONS
 
     def start(self):
         super().start()
+        self._set_flag(F_PLANOGRAM_SET, self._planogram_logic.is_planogram_set())
         self._ev_bus.subscribe(EventType.HW_DISPENSER_IS_READY, self._app_event_handler)
         self._ev_bus.subscribe(EventType.DOOR_STATE_CHANGED, self._app_event_handler)
         self._ev_bus.subscribe(EventType.PLANOGRAM_UPDATE_DONE, self._app_event_handler)
@@ -94,7 +102,6 @@ class MachineLogic(AppModuleWithEvents):
     def _app_event_handler(self, ev: Event):
         """Processes external events"""
         if ev.type == EventType.HW_DISPENSER_IS_READY:
-            self._dispenser_is_ready = True
             self._put_event(MachineEventType.HW_IS_READY, {})
         elif ev.type == EventType.DOOR_STATE_CHANGED:
             self._put_event(MachineEventType.DOOR_STATE_CHANGED, ev.body)
@@ -102,17 +109,28 @@ class MachineLogic(AppModuleWithEvents):
             self._put_event(MachineEventType.PLANOGRAM_UPDATED, {})
 
     def _on_hw_ready(self, params: dict):
-        self._fsm.run()
+        self._set_flag(F_DISPENSER_READY, True)
+        self._run_fsm()
 
     def _on_door_state_changed(self, params: dict):
         try:
-            self._is_door_open = params['open']
-            self._fsm.run()
+            self._set_flag(F_DOOR_OPEN, params['open'])
+            self._run_fsm()
         except KeyError as e:
             self._logger.error(f"Failed to access data structures - {str(e)}")
 
     def _on_planogram_updated(self, params: dict):
-        self._fsm.run()
+        self._set_flag(F_PLANOGRAM_SET, self._planogram_logic.is_planogram_set())
+        self._run_fsm()
+
+    def _set_flag(self, flag: int, value: bool):
+        self._flags = (self._flags | flag) if value else (self._flags & ~flag)
+
+    def _run_fsm(self):
+        """Runs the FSM only if any of the flags checked by transition conditions changed since its last run"""
+        if self._fsm_run_flags != self._flags:
+            self._fsm_run_flags = self._flags
+            self._fsm.run()
 
     def _on_state_changed(self):
         self._ev_bus.post(Event(EventType.MACHINE_STATE_CHANGED, {'state': self._fsm.get_current_state()}))
@@ -121,27 +139,19 @@ class MachineLogic(AppModuleWithEvents):
         self._ev_bus.post(Event(EventType.STARTUP_COMPLETE, {}))
 
     def _check_available_condition(self) -> bool:
-        return (self._planogram_logic.is_planogram_set() and
-                self._dispenser_is_ready and
-                not self._is_door_open and
-                not self._is_hw_error_indicated and
-                not self._is_dispensing_in_progress)
+        return self._flags == (F_PLANOGRAM_SET | F_DISPENSER_READY)
 
     def _check_unavailable_condition(self) -> bool:
-        return (not self._planogram_logic.is_planogram_set() and
-                self._dispenser_is_ready and
-                not self._is_door_open and
-                not self._is_hw_error_indicated and
-                not self._is_dispensing_in_progress)
+        return self._flags == F_DISPENSER_READY
 
     def _check_busy_condition(self) -> bool:
-        return self._is_dispensing_in_progress
+        return (self._flags & F_DISPENSING) != 0
 
     def _check_maintenance_condition(self) -> bool:
-        return self._is_door_open
+        return (self._flags & F_DOOR_OPEN) != 0
 
     def _check_error_condition(self) -> bool:
-        return self._is_hw_error_indicated and not self._is_door_open
+        return (self._flags & (F_HW_ERROR | F_DOOR_OPEN)) == F_HW_ERROR
 
     def _check_update_condition(self) -> bool:
         # TODO
@@ -7,9 +7,12 @@ from core.events import EventType, PlanogramStatusReason
 from db import model
 from core import utils
 import json
+import time
 from pathlib import Path
 from enum import auto, unique
-from copy import deepcopy
+from collections import Counter
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 
 @unique
@@ -47,6 +50,11 @@ class PlanogramEventType(AppModuleEventType):
 #
 
 
+# Events of product update notifications by their update_type, notifications of other types are ignored
+_PRODUCT_UPDATE_EVENTS = {'update': PlanogramEventType.PRODUCT_UPDATED,
+                          'delete': PlanogramEventType.PRODUCT_DELETED}
+
+
 class PlanogramLogic(AppModuleWithEvents):
     """Implements logic that handles corresponding notifications from the Cloud about updates in entire planogram
        or separate items like collections and products, downloads from the Cloud updated data and saves it
@@ -54,6 +62,12 @@ class PlanogramLogic(AppModuleWithEvents):
      """
     MYNAME = 'logic.plangrm'
     REQ_CFG_OPTIONS = ['local_image_url_prefix', 'brand_info_filename', 'ui_model_filename']
+    # Default number of concurrent image downloads, can be overridden with optional 'image_download_workers'
+    IMAGE_DOWNLOAD_WORKERS = 8
+    IMAGE_DOWNLOAD_ATTEMPTS = 3
+    IMAGE_DOWNLOAD_RETRY_DELAY_SEC = 1
+    # Key in the global config table of last_updated of the UI model saved to the file
+    UI_MODEL_LAST_UPDATED_KEY = 'ui_model_last_updated'
 
     def __init__(self, config_data: dict, logger: Logger, ev_bus: EventBus, cloud_client: CloudClient, db: Database,
                  data_dir: Path, img_dir: Path):
@@ -62,14 +76,29 @@ class PlanogramLogic(AppModuleWithEvents):
         self._cloud_client = cloud_client
         self._db = db
         self._data_dir = data_dir
+        # Paths of the files in the data directory, set on start when the configuration is validated
+        self._brand_info_path: Path | None = None
+        self._ui_model_path: Path | None = None
         self._img_dir = img_dir
         self._brand_info = dict()
-        self._current_planogram: list[dict | None] = list()
-        self._new_planogram: list[dict | None] = list()
+        # Brand info as it was last saved to the file
+        self._brand_info_saved = ''
+        self._current_planogram: list[dict | None] = [None] * model.MAX_UNITS
+        self._new_planogram: list[dict | None] = [None] * model.MAX_UNITS
         self._new_collections: list[model.Collection] = list()
         self._new_products: list[model.Product] = list()
         self._new_variants: list[model.Variant] = list()
         self._ui_model = dict()
+        self._ui_model_last_updated: str | None = None
+        # UI model as it was last saved to or read from the file, with the file modification time it corresponds to
+        self._saved_ui_model: dict | None = None
+        self._saved_ui_model_mtime_ns = 0
+        # Product/collection/planogram events that are queued but not processed yet, a notification for an object
+        # which already has a pending event of the same type is dropped, as the handler fetches the latest data anyway
+        self._pending_obj_events: set[tuple[PlanogramEventType, int]] = set()
+        self._pending_lock = Lock()
+        self._dl_pool = ThreadPoolExecutor(
+            max_workers=self._config.get('image_download_workers', PlanogramLogic.IMAGE_DOWNLOAD_WORKERS))
 
     def _get_my_required_cfg_options(self) -> list:
         return PlanogramLogic.REQ_CFG_OPTIONS
@@ -81,23 +110,19 @@ class PlanogramLogic(AppModuleWithEvents):
         iot_client.register_handler('collection', self._on_collection_update)
         iot_client.register_handler('brand', self._on_brand_update)
         iot_client.register_handler('planogram', self._on_planogram_update)
+        self._brand_info_path = self._data_dir.joinpath(self._config['brand_info_filename'])
+        self._ui_model_path = self._data_dir.joinpath(self._config['ui_model_filename'])
         self._brand_info['lastUpdate'] = 0
         self._brand_info['logoId'] = 0
-        for unit_id in range(1, model.MAX_UNITS + 1):
-            self._new_planogram.append(None)
-            inv_items = self._db.get_inventory_items_by_unit(unit_id)
-            if len(inv_items) == 0:
-                self._current_planogram.append(None)
-            else:
-                trays = dict()
-                for item in inv_items:
-                    if item.tray_number not in trays:
-                        trays[item.tray_number] = dict()
-                    if item.location not in trays[item.tray_number]:
-                        trays[item.tray_number][item.location] = {'width': item.width,
-                                                                  'depth': item.depth,
-                                                                  'variant_id': item.variant_id}
-                self._current_planogram.append(trays)
+        self._ui_model_last_updated = self._db.get_global_config(PlanogramLogic.UI_MODEL_LAST_UPDATED_KEY)
+        # Trays of every unit present in the inventory, all units are loaded with one query
+        unit_trays = dict()
+        for item in self._db.get_inventory_items():
+            trays = unit_trays.setdefault(item.unit_id, dict())
+            tray = trays.setdefault(item.tray_number, dict())
+            if item.location not in tray:
+                tray[item.location] = model.Slot(item.width, item.depth, item.variant_id)
+        self._current_planogram = [unit_trays.get(unit_id) for unit_id in range(1, model.MAX_UNITS + 1)]
         self._ev_bus.subscribe(EventType.NEW_PLANOGRAM_APPLY, self._app_event_handler)
         self._ev_bus.subscribe(EventType.NEW_PLANOGRAM_REJECT, self._app_event_handler)
         self._ev_bus.subscribe(EventType.GET_PLANOGRAM, self._app_event_handler)
@@ -112,6 +137,7 @@ class PlanogramLogic(AppModuleWithEvents):
 
     def stop(self):
         super().stop()
+        self._dl_pool.shutdown()
         self._logger.info("Planogram Logic module stopped")
 
     def is_planogram_set(self) -> bool:
@@ -121,38 +147,36 @@ class PlanogramLogic(AppModuleWithEvents):
         return self._current_planogram[0] is not None
 
     def _on_product_update(self, msg: str):
-        self._logger.debug(f"Received: ({msg})")
+        self._logger.debug("Received: (%s)", msg)
         try:
             data = json.loads(msg)
-            upd_type = data['update_type']
-            if upd_type != 'update' and upd_type != 'delete':
+            ev_type = _PRODUCT_UPDATE_EVENTS.get(data['update_type'])
+            if ev_type is None:
                 return
             product_id = data['product_id']
-            if upd_type == 'update':
-                self._put_event(PlanogramEventType.PRODUCT_UPDATED, {'product_id': product_id})
-            else:
-                self._put_event(PlanogramEventType.PRODUCT_DELETED, {'product_id': product_id})
+            self._put_obj_event(ev_type, product_id, {'product_id': product_id})
         except json.JSONDecodeError as e:
             self._logger.error(f"Failed to process product update notification - {str(e)}")
         except KeyError:
             self._logger.warning(f"Received product update notification is malformed")
 
     def _on_collection_update(self, msg: str):
-        self._logger.debug(f"Received: ({msg})")
+        self._logger.debug("Received: (%s)", msg)
         try:
             data = json.loads(msg)
             upd_type = data['update_type']
             if upd_type != 'update':
                 return
             collection_id = data['collection_id']
-            self._put_event(PlanogramEventType.COLLECTION_UPDATED, {'collection_id': collection_id})
+            self._put_obj_event(PlanogramEventType.COLLECTION_UPDATED, collection_id,
+                                {'collection_id': collection_id})
         except json.JSONDecodeError as e:
             self._logger.error(f"Failed to process collection update notification - {str(e)}")
         except KeyError:
             self._logger.warning(f"Received collection update notification is malformed")
 
     def _on_brand_update(self, msg: str):
-        self._logger.debug(f"Received: ({msg})")
+        self._logger.debug("Received: (%s)", msg)
         try:
             data = json.loads(msg)
             last_update = data['lastUpdate']
@@ -163,13 +187,31 @@ class PlanogramLogic(AppModuleWithEvents):
             self._logger.warning(f"Received product brand notification is malformed")
 
     def _on_planogram_update(self, msg: str):
-        self._logger.debug(f"Received: ({msg})")
+        self._logger.debug("Received: (%s)", msg)
         try:
             data = json.loads(msg)
-            self._put_event(PlanogramEventType.PLANOGRAM_UPDATED, {})
+            # There is only one planogram, so any ID identifies it
+            self._put_obj_event(PlanogramEventType.PLANOGRAM_UPDATED, 0, {})
         except json.JSONDecodeError as e:
             self._logger.error(f"Failed to process planogram update notification - {str(e)}")
 
+    def _put_obj_event(self, ev_type: PlanogramEventType, obj_id: int, ev_body: dict):
+        with self._pending_lock:
+            if (ev_type, obj_id) in self._pending_obj_events:
+                self._logger.debug("Event %s for object %s is already pending, skipping", ev_type.name, obj_id)
+                return
+            self._pending_obj_events.add((ev_type, obj_id))
+        self._put_event(ev_type, ev_body)
+
+    def _take_obj_event(self, ev_type: PlanogramEventType, obj_id: int):
+        """Marks the object event as being processed, so a new notification for the object is queued again"""
+        with self._pending_lock:
+            self._pending_obj_events.discard((ev_type, obj_id))
+
+    def _is_obj_event_pending(self, ev_type: PlanogramEventType, obj_id: int) -> bool:
+        with self._pending_lock:
+            return (ev_type, obj_id) in self._pending_obj_events
+
     def _app_event_handler(self, ev: Event):
         """Processes external events"""
         if ev.type == EventType.NEW_PLANOGRAM_APPLY:
@@ -185,6 +227,10 @@ class PlanogramLogic(AppModuleWithEvents):
             self._put_event(PlanogramEventType.GET_PLANOGRAM, {})
 
     def _product_updated_event_handler(self, params: dict):
+        self._take_obj_event(PlanogramEventType.PRODUCT_UPDATED, params['product_id'])
+        if self._is_obj_event_pending(PlanogramEventType.PRODUCT_DELETED, params['product_id']):
+            # The product is going to be deleted anyway, no need to fetch it
+            return
         try:
             prod = self._db.get_product(params['product_id'])
             if prod is None:
@@ -210,6 +256,7 @@ class PlanogramLogic(AppModuleWithEvents):
             pass
 
     def _product_deleted_event_handler(self, params: dict):
+        self._take_obj_event(PlanogramEventType.PRODUCT_DELETED, params['product_id'])
         try:
             prod = self._db.get_product(params['product_id'])
             if prod is None:
@@ -219,12 +266,13 @@ class PlanogramLogic(AppModuleWithEvents):
                 if var is not None:
                     var.deleted = True
                     self._db.update_variant(var)
-                    self._logger.info(f"Variant {var.obj_id} was set to deleted")
+                    self._logger.info("Variant %s was set to deleted", var.obj_id)
         except utils.DbError as e:
             # TODO: telemetry
             pass
 
     def _collection_updated_event_handler(self, params: dict):
+        self._take_obj_event(PlanogramEventType.COLLECTION_UPDATED, params['collection_id'])
         try:
             coll = self._db.get_collection(params['collection_id'])
             if coll is None:
@@ -257,28 +305,24 @@ class PlanogramLogic(AppModuleWithEvents):
             upd_brand_info = self._cloud_client.invoke_api_get('brand', {})
             if upd_brand_info['lastUpdate'] > self._brand_info['lastUpdate']:
                 if upd_brand_info['logoId'] != self._brand_info['logoId']:
-                    try:
-                        image_name = self._cloud_client.download_image(upd_brand_info['logoUrl'], self._img_dir)
-                        self._brand_info = deepcopy(upd_brand_info)
+                    image_name = self._safe_download(upd_brand_info['logoUrl'])
+                    if image_name is not None:
+                        self._brand_info = upd_brand_info
                         self._brand_info['logoUrl'] = self._config['local_image_url_prefix'] + image_name
-                    except utils.CloudApiImageDownloadError as e:
-                        self._logger.error(f"Failed to download brand logo from the Cloud - {e.msg}")
-                    except utils.CloudApiServerError as e:
-                        self._logger.error(f"Failed to download brand logo from the Cloud, server returned: "
-                                           f"code {e.status_code}, message ({e.response})")
-                    except utils.CloudApiConnectionError as e:
-                        self._logger.error(f"Failed to connect to the Cloud to download brand logo - {e.msg}")
-                    except utils.CloudApiTimeoutError:
-                        self._logger.error("Failed to download brand logo from the Cloud due to timeout")
                 else:
                     # Logo has not changed, so preserve the current local URL
                     curr_logo_url = self._brand_info['logoUrl']
-                    self._brand_info = deepcopy(upd_brand_info)
+                    self._brand_info = upd_brand_info
                     self._brand_info['logoUrl'] = curr_logo_url
-                with open(self._data_dir.joinpath(self._config['brand_info_filename']), 'w') as f:
-                    json.dump(self._brand_info, f, indent=4)
-                self._logger.debug("Brand info is saved to file")
-                self._ev_bus.post(Event(EventType.BRAND_INFO_UPDATED, {}))
+                # Serialized at once and written with a single call, json.dump() writes every chunk separately
+                brand_info_data = json.dumps(self._brand_info, indent=4)
+                if brand_info_data != self._brand_info_saved:
+                    utils.write_text_atomically(self._brand_info_path, brand_info_data)
+                    self._brand_info_saved = brand_info_data
+                    self._logger.debug("Brand info is saved to file")
+                    self._ev_bus.post(Event(EventType.BRAND_INFO_UPDATED, {}))
+                else:
+                    self._logger.debug("Brand info content has not changed, file is kept")
             else:
                 self._logger.info("Retrieved brand-info but it seems we already have the latest")
         except utils.CloudApiNotFound:
@@ -299,6 +343,7 @@ class PlanogramLogic(AppModuleWithEvents):
         """Invoked in two cases: when a notification arrives from the Cloud that the planogram was changed
            and when technical personnel uses maintenance UI and wants to get the latest planogram from the Cloud
         """
+        self._take_obj_event(PlanogramEventType.PLANOGRAM_UPDATED, 0)
         is_ok = False
         try:
             req_params = {'deviceId': ''}
@@ -309,15 +354,10 @@ class PlanogramLogic(AppModuleWithEvents):
                     self._logger.error(f"Received planogram contains data for unit with incorrect number {unit_id}")
                     # TODO: telemetry
                     return
-                trays = dict()
-                for tray in stock['trays']:
-                    if tray['number'] not in trays:
-                        trays[tray['number']] = dict()
-                    for slot in tray['slots']:
-                        trays[tray['number']][slot['number']] = {'width': slot['width'],
-                                                                 'depth': slot['depth'],
-                                                                 'variant_id': slot['variantId']}
-                self._new_planogram[unit_id - 1] = trays
+                self._new_planogram[unit_id - 1] = {
+                    tray['number']: {slot['number']: model.Slot(slot['width'], slot['depth'], slot['variantId'])
+                                     for slot in tray['slots']}
+                    for tray in stock['trays']}
             is_equal = True
             for unit_id in range(1, model.MAX_UNITS + 1):
                 if self._new_planogram[unit_id - 1] is None:
@@ -361,7 +401,7 @@ class PlanogramLogic(AppModuleWithEvents):
                         var.add_option(model.VariantOption(var.obj_id, opt['type'], opt['value']))
                     self._new_variants.append(var)
                 self._new_products.append(prod)
-            self._ui_model = deepcopy(planogram_data['uiModel'])
+            self._ui_model = planogram_data['uiModel']
             self._process_ui_model()
             if is_equal:
                 self._apply_new_data()
@@ -405,8 +445,11 @@ class PlanogramLogic(AppModuleWithEvents):
                 for prop in loc['properties']:
                     prod.add_prop(lang, model.ObjectProperty(prop['type'], prop['name'], prop['value']))
         self._db.update_product(prod)
-        self._logger.info(f"Product {prod.obj_id} was updated")
+        self._logger.info("Product %s was updated", prod.obj_id)
 
+        updated_vars = list()
+        # Variants with changed images together with the image data
+        downloads = list()
         for var_data in upd_prod_data['variants']:
             var_id = var_data['id']
             if var_id in prod.variants:
@@ -429,22 +472,17 @@ class PlanogramLogic(AppModuleWithEvents):
                 var_image_data = var_data['image']
                 image_name = utils.get_name_from_url(var_image_data['url'])
                 if var_image_data['last_update'] != var.media.last_update or image_name != var.media.filename:
-                    try:
-                        image_name = self._cloud_client.download_image(var_image_data['url'], self._img_dir)
-                        media = model.Media(image_name, var_image_data['last_update'])
-                        var.media_id = self._db.add_media(media)
-                        var.set_media(media)
-                    except utils.CloudApiImageDownloadError as e:
-                        self._logger.error(f"Failed to download image from the Cloud - {e.msg}")
-                    except utils.CloudApiServerError as e:
-                        self._logger.error(f"Failed to download image from the Cloud, server returned: "
-                                           f"code {e.status_code}, message ({e.response})")
-                    except utils.CloudApiConnectionError as e:
-                        self._logger.error(f"Failed to connect to the Cloud to download image - {e.msg}")
-                    except utils.CloudApiTimeoutError:
-                        self._logger.error("Failed to download image from the Cloud due to timeout")
-                self._db.update_variant(var)
-                self._logger.info(f"Variant {var.obj_id} was updated")
+                    downloads.append((var, var_image_data))
+                updated_vars.append(var)
+        image_names = self._download_images([image_data['url'] for _, image_data in downloads])
+        for (var, var_image_data), image_name in zip(downloads, image_names):
+            if image_name is not None:
+                media = model.Media(image_name, var_image_data['last_update'])
+                var.media_id = self._db.add_media(media)
+                var.set_media(media)
+        for var in updated_vars:
+            self._db.update_variant(var)
+            self._logger.info("Variant %s was updated", var.obj_id)
 
     def _update_collection(self, coll: model.Collection, upd_coll_data: dict):
         last_update = float(upd_coll_data['last_update'])
@@ -460,268 +498,218 @@ class PlanogramLogic(AppModuleWithEvents):
             coll_image_data = upd_coll_data['image']
             image_name = utils.get_name_from_url(coll_image_data['url'])
             if coll_image_data['last_update'] != coll.media.last_update or image_name != coll.media.filename:
-                try:
-                    image_name = self._cloud_client.download_image(coll_image_data['url'], self._img_dir)
+                image_name = self._safe_download(coll_image_data['url'])
+                if image_name is not None:
                     media = model.Media(image_name, coll_image_data['last_update'])
                     coll.media_id = self._db.add_media(media)
                     coll.set_media(media)
-                except utils.CloudApiImageDownloadError as e:
-                    self._logger.error(f"Failed to download image from the Cloud - {e.msg}")
-                except utils.CloudApiServerError as e:
-                    self._logger.error(f"Failed to download image from the Cloud, server returned: "
-                                       f"code {e.status_code}, message ({e.response})")
-                except utils.CloudApiConnectionError as e:
-                    self._logger.error(f"Failed to connect to the Cloud to download image - {e.msg}")
-                except utils.CloudApiTimeoutError:
-                    self._logger.error("Failed to download image from the Cloud due to timeout")
             self._db.update_collection(coll)
-            self._logger.info(f"Collection {coll.obj_id} was updated")
+            self._logger.info("Collection %s was updated", coll.obj_id)
+
+    def _download_images(self, urls: list[str]) -> list[str | None]:
+        """Downloads images concurrently. Returns names of the stored files in the order of URLs,
+           None for images which failed to download
+        """
+        futures = [self._dl_pool.submit(self._safe_download, url) for url in urls]
+        return [fut.result() for fut in futures]
+
+    def _safe_download(self, url: str) -> str | None:
+        """Downloads the image on the calling thread. Returns name of the stored file, None if download failed"""
+        try:
+            return self._download_image(url)
+        except utils.CloudApiError as e:
+            self._logger.error(f"Failed to download image ({url}) from the Cloud, {e.log_message()}")
+            return None
+
+    def _download_image(self, url: str) -> str:
+        """Retries with increasing delay if the Cloud is unreachable"""
+        delay = PlanogramLogic.IMAGE_DOWNLOAD_RETRY_DELAY_SEC
+        for attempt in range(1, PlanogramLogic.IMAGE_DOWNLOAD_ATTEMPTS):
+            try:
+                return self._cloud_client.download_image(url, self._img_dir)
+            except (utils.CloudApiConnectionError, utils.CloudApiTimeoutError) as e:
+                self._logger.warning(f"Attempt {attempt} to download image ({url}) failed, {e.log_message()}")
+                time.sleep(delay)
+                delay *= 2
+        return self._cloud_client.download_image(url, self._img_dir)
 
     @staticmethod
-    def _compare_planogram_trays(current_trays: dict, new_trays: dict) -> bool:
-        if len(current_trays) != len(new_trays):
-            return False
-        if set(current_trays.keys()) != set(new_trays.keys()):
-            return False
-        for k in current_trays.keys():
-            curr_tray = current_trays[k]
-            new_tray = new_trays[k]
-            if len(curr_tray) != len(new_tray):
-                return False
-            if set(curr_tray.keys()) != set(new_tray.keys()):
-                return False
-            for loc in curr_tray.keys():
-                curr_slot = curr_tray[loc]
-                new_slot = new_tray[loc]
-                if (curr_slot['width'] != new_slot['width'] or curr_slot['depth'] != new_slot['depth'] or
-                        curr_slot['variant_id'] != new_slot['variant_id']):
-                    return False
-        return True
+    def _compare_planogram_trays(current_trays: dict | None, new_trays: dict) -> bool:
+        # Trays of both planograms have the same structure {tray: {location: slot}}, so dict equality compares them
+        return current_trays == new_trays
 
     def _apply_new_data(self):
         """Check received in the latest planogram objects are newer than the existent ones; update those that newer;
            download new images if needed; remove objects, which are absent in the new planogram; save UiModel
         """
         try:
+            added_products = list()
+            updated_products = list()
+            added_collections = list()
+            updated_collections = list()
+            added_variants = list()
+            updated_variants = list()
+            prod_versions = self._db.get_product_versions()
             for new_prod in self._new_products:
-                prod = self._db.get_product(new_prod.obj_id)
-                if prod is None:
-                    self._db.add_product(new_prod)
-                else:
-                    if new_prod.last_update != prod.last_update:
-                        self._db.update_product(new_prod)
+                last_update = prod_versions.get(new_prod.obj_id)
+                if last_update is None:
+                    added_products.append(new_prod)
+                elif new_prod.last_update != last_update:
+                    updated_products.append(new_prod)
+            # Collections and variants with new images, which are downloaded concurrently
+            downloads: list[model.Collection | model.Variant] = list()
+            coll_versions = self._db.get_collection_versions()
             for new_coll in self._new_collections:
-                coll = self._db.get_collection(new_coll.obj_id)
-                if coll is None:
-                    try:
-                        image_name = self._cloud_client.download_image(new_coll.media.filename, self._img_dir)
-                        media = model.Media(image_name, new_coll.media.last_update)
-                        new_coll.media_id = self._db.add_media(media)
+                coll_version = coll_versions.get(new_coll.obj_id)
+                if coll_version is None:
+                    downloads.append(new_coll)
+                    added_collections.append(new_coll)
+                    continue
+                last_update, media_id, media = coll_version
+                if new_coll.last_update != last_update:
+                    if media is None or new_coll.media.last_update != media.last_update:
+                        downloads.append(new_coll)
+                    else:
+                        new_coll.media_id = media_id
                         new_coll.set_media(media)
-                    except utils.CloudApiImageDownloadError as e:
-                        self._logger.error(f"Failed to download image from the Cloud - {e.msg}")
-                    except utils.CloudApiServerError as e:
-                        self._logger.error(f"Failed to download image from the Cloud, server returned: "
-                                           f"code {e.status_code}, message ({e.response})")
-                    except utils.CloudApiConnectionError as e:
-                        self._logger.error(f"Failed to connect to the Cloud to download image - {e.msg}")
-                    except utils.CloudApiTimeoutError:
-                        self._logger.error("Failed to download image from the Cloud due to timeout")
-                    self._db.add_collection(new_coll)
-                else:
-                    if new_coll.last_update != coll.last_update:
-                        if new_coll.media.last_update != coll.media.last_update:
-                            try:
-                                image_name = self._cloud_client.download_image(new_coll.media.filename, self._img_dir)
-                                media = model.Media(image_name, new_coll.media.last_update)
-                                new_coll.media_id = self._db.add_media(media)
-                                new_coll.set_media(media)
-                            except utils.CloudApiImageDownloadError as e:
-                                self._logger.error(f"Failed to download image from the Cloud - {e.msg}")
-                            except utils.CloudApiServerError as e:
-                                self._logger.error(f"Failed to download image from the Cloud, server returned: "
-                                                   f"code {e.status_code}, message ({e.response})")
-                            except utils.CloudApiConnectionError as e:
-                                self._logger.error(f"Failed to connect to the Cloud to download image - {e.msg}")
-                            except utils.CloudApiTimeoutError:
-                                self._logger.error("Failed to download image from the Cloud due to timeout")
-                        else:
-                            new_coll.media_id = coll.media_id
-                            new_coll.set_media(coll.media)
-                        self._db.update_collection(new_coll)
+                    updated_collections.append(new_coll)
+            var_media = self._db.get_variant_media()
             for new_var in self._new_variants:
-                var = self._db.get_variant(new_var.obj_id)
-                if var is None:
-                    try:
-                        image_name = self._cloud_client.download_image(new_var.media.filename, self._img_dir)
-                        media = model.Media(image_name, new_var.media.last_update)
-                        new_var.media_id = self._db.add_media(media)
-                        new_var.set_media(media)
-                    except utils.CloudApiImageDownloadError as e:
-                        self._logger.error(f"Failed to download image from the Cloud - {e.msg}")
-                    except utils.CloudApiServerError as e:
-                        self._logger.error(f"Failed to download image from the Cloud, server returned: "
-                                           f"code {e.status_code}, message ({e.response})")
-                    except utils.CloudApiConnectionError as e:
-                        self._logger.error(f"Failed to connect to the Cloud to download image - {e.msg}")
-                    except utils.CloudApiTimeoutError:
-                        self._logger.error("Failed to download image from the Cloud due to timeout")
-                    self._db.add_variant(new_var)
+                if new_var.obj_id not in var_media:
+                    downloads.append(new_var)
+                    added_variants.append(new_var)
+                    continue
+                media_id, media = var_media[new_var.obj_id]
+                if media is None or new_var.media.last_update != media.last_update:
+                    downloads.append(new_var)
                 else:
-                    if new_var.media.last_update != var.media.last_update:
-                        try:
-                            image_name = self._cloud_client.download_image(new_var.media.filename, self._img_dir)
-                            media = model.Media(image_name, new_var.media.last_update)
-                            new_var.media_id = self._db.add_media(media)
-                            new_var.set_media(media)
-                        except utils.CloudApiImageDownloadError as e:
-                            self._logger.error(f"Failed to download image from the Cloud - {e.msg}")
-                        except utils.CloudApiServerError as e:
-                            self._logger.error(f"Failed to download image from the Cloud, server returned: "
-                                               f"code {e.status_code}, message ({e.response})")
-                        except utils.CloudApiConnectionError as e:
-                            self._logger.error(f"Failed to connect to the Cloud to download image - {e.msg}")
-                        except utils.CloudApiTimeoutError:
-                            self._logger.error("Failed to download image from the Cloud due to timeout")
-                    else:
-                        new_var.media_id = var.media_id
-                        new_var.set_media(var.media)
-                    self._db.update_variant(new_var)
-
-            all_var_ids = self._db.get_variant_ids()
-            new_var_ids = [v.obj_id for v in self._new_variants]
-            diff_var_ids = set(all_var_ids).difference(new_var_ids)
-            for var_id in diff_var_ids:
-                self._db.remove_variant(var_id)
-            all_prod_ids = self._db.get_product_ids()
-            new_prod_ids = [p.obj_id for p in self._new_products]
-            diff_prod_ids = set(all_prod_ids).difference(new_prod_ids)
-            for prod_id in diff_prod_ids:
-                self._db.remove_product(prod_id)
-            all_coll_ids = self._db.get_collection_ids()
-            new_coll_ids = [c.obj_id for c in self._new_collections]
-            diff_coll_ids = set(all_coll_ids).difference(new_coll_ids)
-            for coll_id in diff_coll_ids:
-                self._db.remove_collection(coll_id)
+                    new_var.media_id = media_id
+                    new_var.set_media(media)
+                updated_variants.append(new_var)
+            image_names = self._download_images([obj.media.filename for obj in downloads])
+            for obj, image_name in zip(downloads, image_names):
+                if image_name is not None:
+                    media = model.Media(image_name, obj.media.last_update)
+                    obj.media_id = self._db.add_media(media)
+                    obj.set_media(media)
+
+            # All changes are written in one transaction, images are already downloaded at this point
+            self._db.apply_catalog_batch(added_products=added_products, updated_products=updated_products,
+                                         added_collections=added_collections,
+                                         updated_collections=updated_collections,
+                                         added_variants=added_variants, updated_variants=updated_variants,
+                                         kept_variants={v.obj_id for v in self._new_variants},
+                                         kept_products={p.obj_id for p in self._new_products},
+                                         kept_collections={c.obj_id for c in self._new_collections})
 
             if 'updated' in self._ui_model:
                 del self._ui_model['updated']
-                ui_model_file = self._data_dir.joinpath(self._config['ui_model_filename'])
-                with open(ui_model_file, 'w') as f:
-                    json.dump(self._ui_model, f, indent=4)
+                utils.write_text_atomically(self._ui_model_path, json.dumps(self._ui_model, indent=4))
+                self._saved_ui_model = self._ui_model
+                self._saved_ui_model_mtime_ns = self._ui_model_path.stat().st_mtime_ns
+                self._ui_model_last_updated = str(self._ui_model['last_updated'])
+                self._db.set_global_config(PlanogramLogic.UI_MODEL_LAST_UPDATED_KEY, self._ui_model_last_updated)
                 self._ev_bus.post(Event(EventType.UI_MODEL_UPDATED, {}))
         except utils.DbError as e:
             # TODO: telemetry
             pass
 
     def _process_ui_model(self):
-        ui_model_file = self._data_dir.joinpath(self._config['ui_model_filename'])
-        if ui_model_file.exists():
-            with open(ui_model_file) as f:
-                curr_ui_model = json.load(f)
-                curr_exists = True
-                changed = self._ui_model['last_updated'] != curr_ui_model['last_updated']
+        curr_exists = self._ui_model_path.exists()
+        if str(self._ui_model['last_updated']) == self._ui_model_last_updated and curr_exists:
+            # Same version as the saved one, no need to read and parse the file
+            return
+        if curr_exists:
+            curr_ui_model = self._load_saved_ui_model()
+            changed = self._ui_model['last_updated'] != curr_ui_model['last_updated']
         else:
-            curr_exists = False
             changed = True
         if not changed:
+            self._ui_model_last_updated = str(self._ui_model['last_updated'])
             return
         self._logger.debug("Ui Model has updated, processing")
+        # Sections of the saved model by profile id and section type
+        curr_sections = dict()
+        if curr_exists:
+            curr_sections = {(curr_prof_id, curr_section['type']): curr_section
+                             for curr_prof_id, curr_profile in curr_ui_model['profiles'].items()
+                             for curr_section in curr_profile['sections']}
+        # Descriptions of sections with new images, which are downloaded concurrently
+        downloads = list()
         # Don't process brand in ui_model, it is obsolete
         for prof_id, profile in self._ui_model['profiles'].items():
             for section in profile['sections']:
-                if section['type'] == 'left-banner':
-                    new_image_id = section['description']['imageId']
-                    curr_image_id = 0
-                    if curr_exists:
-                        if prof_id in curr_ui_model['profiles']:
-                            for curr_section in curr_ui_model['profiles'][prof_id]['sections']:
-                                if curr_section['type'] == 'left-banner':
-                                    curr_image_id = curr_section['description']['imageId']
-                                    break
-                    if new_image_id != curr_image_id:
-                        self._logger.debug(f"Profile {prof_id}, section left-banner has new image id, downloading")
-                        try:
-                            image_name = self._cloud_client.download_image(section['description']['imageUrl'],
-                                                                           self._img_dir)
-                            section['description']['imageUrl'] = self._config['local_image_url_prefix'] + image_name
-                        except utils.CloudApiImageDownloadError as e:
-                            self._logger.error(f"Failed to download image from the Cloud - {e.msg}")
-                        except utils.CloudApiServerError as e:
-                            self._logger.error(f"Failed to download image from the Cloud, server returned: "
-                                               f"code {e.status_code}, message ({e.response})")
-                        except utils.CloudApiConnectionError as e:
-                            self._logger.error(f"Failed to connect to the Cloud to download image - {e.msg}")
-                        except utils.CloudApiTimeoutError:
-                            self._logger.error("Failed to download image from the Cloud due to timeout")
-                elif section['type'] == 'right-banner':
+                if section['type'] in ('left-banner', 'right-banner'):
                     new_image_id = section['description']['imageId']
-                    curr_image_id = 0
-                    if curr_exists:
-                        if prof_id in curr_ui_model['profiles']:
-                            for curr_section in curr_ui_model['profiles'][prof_id]['sections']:
-                                if curr_section['type'] == 'right-banner':
-                                    curr_image_id = curr_section['description']['imageId']
-                                    break
+                    curr_section = curr_sections.get((prof_id, section['type']))
+                    curr_image_id = curr_section['description']['imageId'] if curr_section is not None else 0
                     if new_image_id != curr_image_id:
-                        self._logger.debug(f"Profile {prof_id}, section right-banner has new image id, downloading")
-                        try:
-                            image_name = self._cloud_client.download_image(section['description']['imageUrl'],
-                                                                           self._img_dir)
-                            section['description']['imageUrl'] = self._config['local_image_url_prefix'] + image_name
-                        except utils.CloudApiImageDownloadError as e:
-                            self._logger.error(f"Failed to download image from the Cloud - {e.msg}")
-                        except utils.CloudApiServerError as e:
-                            self._logger.error(f"Failed to download image from the Cloud, server returned: "
-                                               f"code {e.status_code}, message ({e.response})")
-                        except utils.CloudApiConnectionError as e:
-                            self._logger.error(f"Failed to connect to the Cloud to download image - {e.msg}")
-                        except utils.CloudApiTimeoutError:
-                            self._logger.error("Failed to download image from the Cloud due to timeout")
+                        self._logger.debug("Profile %s, section %s has new image id, downloading",
+                                           prof_id, section['type'])
+                        downloads.append(section['description'])
+        image_names = self._download_images([descr['imageUrl'] for descr in downloads])
+        for descr, image_name in zip(downloads, image_names):
+            if image_name is not None:
+                descr['imageUrl'] = self._config['local_image_url_prefix'] + image_name
         # Add a flag, that the model was updated and needs to be saved, should be removed before saving
         self._ui_model['updated'] = True
 
+    def _load_saved_ui_model(self) -> dict:
+        """Returns the UI model from the file, it is parsed again only if the file was modified since the last call"""
+        mtime_ns = self._ui_model_path.stat().st_mtime_ns
+        if self._saved_ui_model is None or mtime_ns != self._saved_ui_model_mtime_ns:
+            self._saved_ui_model = json.loads(self._ui_model_path.read_text())
+            self._saved_ui_model_mtime_ns = mtime_ns
+        return self._saved_ui_model
+
     def _apply_new_planogram(self):
         try:
+            # Variants which were added to, moved within or removed from any slot
+            changed_variants = set()
+            added_items = list()
+            updated_items = list()
+            removed_items = list()
             for unit_id in range(1, model.MAX_UNITS + 1):
                 new_trays = self._new_planogram[unit_id - 1]
-                curr_trays = self._current_planogram[unit_id - 1]
-                for tray_num, tray in new_trays.items():
-                    if tray_num not in curr_trays:
-                        for loc, slot in tray.items():
-                            self._db.add_inventory_item(model.InventoryItem(unit_id, tray_num, loc, slot['variant_id'],
-                                                                            slot['width'], 0, slot['depth']))
-                    else:
-                        curr_tray = curr_trays[tray_num]
-                        for loc, slot in tray.items():
-                            if loc not in curr_tray:
-                                self._db.add_inventory_item(model.InventoryItem(unit_id, tray_num, loc,
-                                                                                slot['variant_id'], slot['width'],
-                                                                                0, slot['depth']))
-                            else:
-                                curr_slot = curr_tray[loc]
-                                if (slot['variant_id'] != curr_slot['variant_id'] or slot['width'] != curr_slot['width']
-                                        or slot['depth'] != curr_slot['depth']):
-                                    self._db.update_inventory_item(model.InventoryItem(unit_id, tray_num, loc,
-                                                                                       slot['variant_id'],
-                                                                                       slot['width'], 0, slot['depth']))
-                for tray_num, tray in curr_trays.items():
-                    if tray_num not in new_trays:
-                        for loc, slot in tray.items():
-                            self._db.remove_inventory_item(model.InventoryItem(unit_id, tray_num, loc,
-                                                                               slot['variant_id'], slot['width'],
-                                                                               0, slot['depth']))
-                    else:
-                        new_tray = new_trays[tray_num]
-                        for loc, slot in tray.items():
-                            if loc not in new_tray:
-                                self._db.remove_inventory_item(model.InventoryItem(unit_id, tray_num, loc,
-                                                                                   slot['variant_id'], slot['width'],
-                                                                                   0, slot['depth']))
-            self._current_planogram = deepcopy(self._new_planogram)
-            for unit_id in range(1, model.MAX_UNITS + 1):
-                self._new_planogram[unit_id-1] = None
-            self._ev_bus.post(Event(EventType.PLANOGRAM_UPDATE_DONE, {}))
+                curr_trays = self._current_planogram[unit_id - 1] or {}
+                for tray_num in new_trays.keys() - curr_trays.keys():
+                    for loc, slot in new_trays[tray_num].items():
+                        added_items.append(model.InventoryItem(unit_id, tray_num, loc, slot.variant_id,
+                                                               slot.width, 0, slot.depth))
+                        changed_variants.add(slot.variant_id)
+                for tray_num in curr_trays.keys() - new_trays.keys():
+                    for loc, slot in curr_trays[tray_num].items():
+                        removed_items.append(model.InventoryItem(unit_id, tray_num, loc, slot.variant_id,
+                                                                 slot.width, 0, slot.depth))
+                        changed_variants.add(slot.variant_id)
+                for tray_num in new_trays.keys() & curr_trays.keys():
+                    new_tray = new_trays[tray_num]
+                    curr_tray = curr_trays[tray_num]
+                    if new_tray == curr_tray:
+                        continue
+                    for loc in new_tray.keys() - curr_tray.keys():
+                        slot = new_tray[loc]
+                        added_items.append(model.InventoryItem(unit_id, tray_num, loc, slot.variant_id,
+                                                               slot.width, 0, slot.depth))
+                        changed_variants.add(slot.variant_id)
+                    for loc in curr_tray.keys() - new_tray.keys():
+                        slot = curr_tray[loc]
+                        removed_items.append(model.InventoryItem(unit_id, tray_num, loc, slot.variant_id,
+                                                                 slot.width, 0, slot.depth))
+                        changed_variants.add(slot.variant_id)
+                    for loc in new_tray.keys() & curr_tray.keys():
+                        slot = new_tray[loc]
+                        curr_slot = curr_tray[loc]
+                        if slot != curr_slot:
+                            updated_items.append(model.InventoryItem(unit_id, tray_num, loc, slot.variant_id,
+                                                                     slot.width, 0, slot.depth))
+                            changed_variants.add(slot.variant_id)
+                            changed_variants.add(curr_slot.variant_id)
+            self._db.apply_inventory_batch(added=added_items, updated=updated_items, removed=removed_items)
+            # Trays of the new planogram are not modified after they are built, so they are taken over as is
+            self._current_planogram = self._new_planogram
+            self._new_planogram = [None] * model.MAX_UNITS
+            self._ev_bus.post(Event(EventType.PLANOGRAM_UPDATE_DONE, {'variants': list(changed_variants)}))
         except KeyError as e:
             self._logger.error(f"Planogram data structure is malformed - {str(e)}")
         except utils.DbError as e:
@@ -731,35 +719,43 @@ class PlanogramLogic(AppModuleWithEvents):
     def _validate_new_planogram_against_reservations(self) -> (bool, PlanogramStatusReason):
         """Checks if there is a conflict between new planogram and active remote reservations"""
         # Check if there are reserved variants absent in the new planogram and block planogram applying if it is so
-        reserved_variants = list()
-        new_variant_ids = [var.obj_id for var in self._new_variants]
+        reserved_variants = set()
+        new_variant_ids = {var.obj_id for var in self._new_variants}
         carts = self._db.get_carts()
         for cart in carts:
             if (cart.cart_type == model.CartType.REMOTE and (cart.status == model.CartStatus.PRERESERVATION or
                                                              cart.status == model.CartStatus.RESERVED)):
                 cart_contents = self._db.get_cart_items(cart.obj_id)
                 for item in cart_contents:
-                    reserved_variants.append(item.variant_id)
+                    if item.variant_id in reserved_variants:
+                        continue
+                    reserved_variants.add(item.variant_id)
                     if item.variant_id not in new_variant_ids:
-                        self._logger.info(f"Reserved variant {item.variant_id} is not present in the new planogram")
+                        self._logger.info("Reserved variant %s is not present in the new planogram", item.variant_id)
                         return False, PlanogramStatusReason.RESERVED_PRODUCT_ABSENT
+        if not reserved_variants:
+            return True, PlanogramStatusReason.NO_REASON
         # Now verify that number of slots for every reserved variant in the new planogram not less than now
+        current_slots_counts = self._count_slots(self._current_planogram)
+        new_slots_counts = self._count_slots(self._new_planogram)
         for var_id in reserved_variants:
             for unit_id in range(1, model.MAX_UNITS+1):
-                current_slots_count = 0
-                new_slots_count = 0
-                curr_trays = self._current_planogram[unit_id-1]
-                for _, tray in curr_trays.items():
-                    for _, slot in tray.item():
-                        if slot['variant_id'] == var_id:
-                            current_slots_count += 1
-                new_trays = self._new_planogram[unit_id-1]
-                for _, tray in new_trays.items():
-                    for _, slot in tray.items():
-                        if slot['variant_id'] == var_id:
-                            new_slots_count += 1
+                current_slots_count = current_slots_counts[(unit_id, var_id)]
+                new_slots_count = new_slots_counts[(unit_id, var_id)]
                 if current_slots_count > new_slots_count:
-                    self._logger.info(f"Reserved variant {var_id} in unit {unit_id} is in {current_slots_count} "
-                                      f"slot(s) now but in {new_slots_count} slot(s) in the new planogram")
+                    self._logger.info("Reserved variant %s in unit %s is in %s slot(s) now but in %s slot(s) in the "
+                                      "new planogram", var_id, unit_id, current_slots_count, new_slots_count)
                     return False, PlanogramStatusReason.RESERVED_PRODUCT_OCCUPIES_LESS_SLOTS
         return True, PlanogramStatusReason.NO_REASON
+
+    @staticmethod
+    def _count_slots(planogram: list[dict | None]) -> Counter:
+        """Returns number of slots occupied by every variant in every unit of the planogram by (unit_id, variant_id)"""
+        counts = Counter()
+        for unit_id, trays in enumerate(planogram, 1):
+            if trays is None:
+                continue
+            for tray in trays.values():
+                for slot in tray.values():
+                    counts[(unit_id, slot.variant_id)] += 1
+        return counts
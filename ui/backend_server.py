@@ -2,7 +2,7 @@ from http import HTTPStatus
 import json
 from pathlib import Path
 from collections import namedtuple
-from threading import Event as AtomicFlag
+from threading import Event as AtomicFlag, Lock
 from core.rest_server import RestServerBase, RequestHandlerResult
 from core.logger import Logger
 from core.event_bus import EventBus, Event
@@ -13,13 +13,52 @@ from core import utils
 from db import model
 
 RequestHandlerDesc = namedtuple('RequestHandlerDesc', ['handler', 'num_of_expected_params', 'disp_id_req'])
-TransactionIdRequestData = namedtuple('TransactionIdRequestData', ['cart_id', 'waiting', 'success'])
+
+# Replies are encoded without whitespace by a single encoder instance shared by all requests
+_json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+# Valid values of displayId request header mapped to display IDs
+_DISPLAY_IDS = {str(display_id): display_id for display_id in range(1, model.MAX_DISPLAYS + 1)}
+
+# Shown instead of the name and description of an object which has no info in the configured language
+_UNKNOWN_INFO = model.ObjectInfo('?', '?')
+
+# Reply headers which don't depend on the request, the HTTP server only reads them, so they are shared by all replies
+_CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+_TEXT_HEADERS = {**_CORS_HEADERS, 'Content-Type': 'text/plain'}
+_JSON_HEADERS = {**_CORS_HEADERS, 'Content-Type': 'application/json'}
+_OPTIONS_HEADERS = {'Allow': 'GET, PUT, POST, OPTIONS',
+                    **_CORS_HEADERS,
+                    'Access-Control-Allow-Methods': 'GET, PUT, POST, DELETE, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type, displayId'}
+
+
+class TransactionIdRequest:
+    """Transaction ID request waiting for the response from the cart logic"""
+    __slots__ = ('cart_id', 'success', 'ready')
+
+    def __init__(self, cart_id: int):
+        self.cart_id = cart_id
+        self.success = False
+        self.ready = AtomicFlag()
 
 
 class BackendRestServer(RestServerBase):
     """Provides REST API for the Kiosk UI"""
     MYNAME = 'ui.rest'
     REQ_CFG_OPTIONS = ['port', 'ui_model_filename', 'brand_info_filename', 'media', 'transaction_id_timeout']
+    # Transaction IDs of the carts of every display until the real ones are assigned, indexed by display ID
+    UNASSIGNED_TRANSACTION_IDS = tuple("unassigned#" + str(display_id) for display_id in range(model.MAX_DISPLAYS + 1))
+    # Endpoints of every HTTP method, mapped to the handler method name, number of expected query parameters and
+    # whether displayId header is required
+    ENDPOINTS = {'GET': {'test': ('_process_get_test', 0, False),
+                         'brand-info': ('_process_get_brand_info', 0, False),
+                         'ui-model': ('_process_get_ui_model', 0, False),
+                         'collections': ('_process_get_collection', 1, False),
+                         'products': ('_process_get_product', 1, False)},
+                 'POST': {'pickup': ('_process_post_pickup', 0, True)},
+                 'PUT': {'cart': ('_process_put_cart', 0, True)},
+                 'DELETE': {'cart': ('_process_delete_cart', 0, True)}}
 
     def __init__(self, config_data: dict, logger: Logger, ev_bus: EventBus, db: Database, cart_logic: CartLogic,
                  data_dir: Path, lang: str):
@@ -29,26 +68,30 @@ class BackendRestServer(RestServerBase):
         self._data_dir = data_dir
         self._lang = lang
         self._cart_logic = cart_logic
-        self._get_handlers: dict[str, RequestHandlerDesc] = dict()
-        self._post_handlers: dict[str, RequestHandlerDesc] = dict()
-        self._put_handlers: dict[str, RequestHandlerDesc] = dict()
-        self._delete_handlers: dict[str, RequestHandlerDesc] = dict()
-        self._tr_id_ready_flags: list[AtomicFlag] = list()
-        self._tr_id_request_data: list[TransactionIdRequestData] = list()
+        # Handlers are resolved once and ready before the HTTP server is started
+        self._handlers: dict[str, dict[str, RequestHandlerDesc]] = {
+            method: {endpoint: RequestHandlerDesc(getattr(self, name), num_of_params, disp_id_req)
+                     for endpoint, (name, num_of_params, disp_id_req) in endpoints.items()}
+            for method, endpoints in BackendRestServer.ENDPOINTS.items()}
+        # Transaction ID requests waiting for the response by cart ID
+        self._tr_id_requests: dict[int, TransactionIdRequest] = dict()
+        # Guards the requests, they are added and removed by HTTP requests and completed by event bus callbacks
+        self._tr_id_requests_lock = Lock()
+        # Paths of the data files served as is, set on start when the configuration is validated
+        self._brand_info_path: Path | None = None
+        self._ui_model_path: Path | None = None
+        # Frequently used configuration options, set on start when the configuration is validated
+        self._media_prefix = ''
+        self._tr_id_timeout = 0
+        # Contents of the data files by path together with the file modification time they correspond to
+        self._data_file_cache: dict[Path, tuple[int, bytes]] = dict()
 
     def start(self):
+        self._brand_info_path = self._data_dir.joinpath(self._config['brand_info_filename'])
+        self._ui_model_path = self._data_dir.joinpath(self._config['ui_model_filename'])
+        self._media_prefix = self._config['media']
+        self._tr_id_timeout = self._config['transaction_id_timeout']
         super().start()
-        for _ in range(model.MAX_DISPLAYS):
-            self._tr_id_ready_flags.append(AtomicFlag())
-            self._tr_id_request_data.append(TransactionIdRequestData(0, False, False))
-        self._get_handlers['test'] = RequestHandlerDesc(self._process_get_test, 0, False)
-        self._get_handlers['brand-info'] = RequestHandlerDesc(self._process_get_brand_info, 0, False)
-        self._get_handlers['ui-model'] = RequestHandlerDesc(self._process_get_ui_model, 0, False)
-        self._get_handlers['collections'] = RequestHandlerDesc(self._process_get_collection, 1, False)
-        self._get_handlers['products'] = RequestHandlerDesc(self._process_get_product, 1, False)
-        self._put_handlers['cart'] = RequestHandlerDesc(self._process_put_cart, 0, True)
-        self._delete_handlers['cart'] = RequestHandlerDesc(self._process_delete_cart, 0, True)
-        self._post_handlers['pickup'] = RequestHandlerDesc(self._process_post_pickup, 0, True)
         self._ev_bus.subscribe(EventType.BEGIN_TRANSACTION_RESPONSE, self._app_event_handler)
 
     def _get_my_required_cfg_options(self) -> list:
@@ -56,57 +99,36 @@ class BackendRestServer(RestServerBase):
 
     @staticmethod
     def _get_my_transaction_id(display_id: int) -> str:
+        if 0 < display_id <= model.MAX_DISPLAYS:
+            return BackendRestServer.UNASSIGNED_TRANSACTION_IDS[display_id]
         return "unassigned#" + str(display_id)
 
     def _app_event_handler(self, ev: Event):
         """Processes external events"""
         try:
             if ev.type == EventType.BEGIN_TRANSACTION_RESPONSE:
-                for display_id in range(1, model.MAX_DISPLAYS + 1):
-                    if (self._tr_id_request_data[display_id - 1].waiting
-                            and self._tr_id_request_data[display_id - 1].cart_id == ev.body['cart_id']):
-                        self._tr_id_request_data[display_id - 1].success = ev.body['success']
-                        self._tr_id_ready_flags[display_id - 1].set()
-                        break
+                with self._tr_id_requests_lock:
+                    tr_id_req = self._tr_id_requests.get(ev.body['cart_id'])
+                    if tr_id_req is not None:
+                        tr_id_req.success = ev.body['success']
+                        tr_id_req.ready.set()
         except KeyError as e:
             self._logger.error(f"Failed to process event {ev.type} due to data access error - {str(e)}")
 
     def _parse_display_id(self, headers: dict) -> int:
-        if 'displayId' in headers:
-            try:
-                display_id = int(headers['displayId'])
-                return display_id
-            except ValueError:
-                self._logger.warning("Failed to get display_id from the request's headers")
-                return model.NONEXISTENT_DISPLAY_ID
-        self._logger.warning("Unable to locate 'displayId' header in the request")
-        return model.NONEXISTENT_DISPLAY_ID
+        value = headers.get('displayId')
+        if value is None:
+            self._logger.warning("Unable to locate 'displayId' header in the request")
+            return model.NONEXISTENT_DISPLAY_ID
+        display_id = _DISPLAY_IDS.get(value.strip())
+        if display_id is None:
+            self._logger.warning(f"Invalid display_id {value} in the request's headers")
+            return model.NONEXISTENT_DISPLAY_ID
+        return display_id
 
     def _on_get(self, path: str, headers: dict, msg: str) -> RequestHandlerResult:
         self._logger.debug(f"Received GET request for {path}")
-        try:
-            parts = path.split('/')
-            if parts[1] not in self._get_handlers:
-                self._logger.warning(f"Endpoint {parts[1]} not found")
-                return self._generate_reply(HTTPStatus.NOT_FOUND, resp_txt=f"Endpoint {parts[1]} does not exist",
-                                            content_type='text')
-            handler_desc = self._get_handlers[parts[1]]
-            if (len(parts) - 2) < handler_desc.num_of_expected_params:
-                self._logger.warning(f"For endpoint {parts[1]} expected {handler_desc.num_of_expected_params} "
-                                     f"parameters but found {len(parts) - 2}")
-                return self._generate_reply(HTTPStatus.BAD_REQUEST, resp_txt="Mandatory parameter(s) required",
-                                            content_type='text')
-            display_id = model.NONEXISTENT_DISPLAY_ID
-            if handler_desc.disp_id_req:
-                display_id = self._parse_display_id(headers)
-                if display_id == model.NONEXISTENT_DISPLAY_ID:
-                    return self._generate_reply(HTTPStatus.BAD_REQUEST,
-                                                resp_txt="Mandatory header is absent or incorrect",
-                                                content_type='text')
-            return handler_desc.handler(parts[2:], display_id)
-        except IndexError as e:
-            self._logger.error(f"Failed to get endpoint or query parameter from the path - {str(e)}")
-            return self._generate_reply(HTTPStatus.INTERNAL_SERVER_ERROR)
+        return self._dispatch(self._handlers['GET'], path, headers)
 
     def _on_post(self, path: str, headers: dict, msg: str) -> RequestHandlerResult:
         self._logger.debug(f"Received POST request for {path}")
@@ -115,29 +137,7 @@ class BackendRestServer(RestServerBase):
         except json.JSONDecodeError as e:
             self._logger.error(f"Failed to parse a POST request body - {str(e)}")
             return self._generate_reply(HTTPStatus.BAD_REQUEST, resp_txt="Invalid message format", content_type='text')
-        try:
-            parts = path.split('/')
-            if parts[1] not in self._post_handlers:
-                self._logger.warning(f"Endpoint {parts[1]} not found")
-                return self._generate_reply(HTTPStatus.NOT_FOUND, resp_txt=f"Endpoint {parts[1]} does not exist",
-                                            content_type='text')
-            handler_desc = self._post_handlers[parts[1]]
-            if (len(parts) - 2) < handler_desc.num_of_expected_params:
-                self._logger.warning(f"For endpoint {parts[1]} expected {handler_desc.num_of_expected_params} "
-                                     f"parameters but found {len(parts) - 2}")
-                return self._generate_reply(HTTPStatus.BAD_REQUEST, resp_txt="Mandatory parameter(s) required",
-                                            content_type='text')
-            display_id = model.NONEXISTENT_DISPLAY_ID
-            if handler_desc.disp_id_req:
-                display_id = self._parse_display_id(headers)
-                if display_id == model.NONEXISTENT_DISPLAY_ID:
-                    return self._generate_reply(HTTPStatus.BAD_REQUEST,
-                                                resp_txt="Mandatory header is absent or incorrect",
-                                                content_type='text')
-            return handler_desc.handler(parts[2:], display_id, req_obj)
-        except IndexError as e:
-            self._logger.error(f"Failed to get endpoint or query parameter from the path - {str(e)}")
-            return self._generate_reply(HTTPStatus.INTERNAL_SERVER_ERROR)
+        return self._dispatch(self._handlers['POST'], path, headers, req_obj)
 
     def _on_put(self, path: str, headers: dict, msg: str) -> RequestHandlerResult:
         self._logger.debug(f"Received PUT request for {path}")
@@ -146,42 +146,29 @@ class BackendRestServer(RestServerBase):
         except json.JSONDecodeError as e:
             self._logger.error(f"Failed to parse a PUT request body - {str(e)}")
             return self._generate_reply(HTTPStatus.BAD_REQUEST, resp_txt="Invalid message format", content_type='text')
-        try:
-            parts = path.split('/')
-            if parts[1] not in self._put_handlers:
-                self._logger.warning(f"Endpoint {parts[1]} not found")
-                return self._generate_reply(HTTPStatus.NOT_FOUND, resp_txt=f"Endpoint {parts[1]} does not exist",
-                                            content_type='text')
-            handler_desc = self._put_handlers[parts[1]]
-            if (len(parts) - 2) < handler_desc.num_of_expected_params:
-                self._logger.warning(f"For endpoint {parts[1]} expected {handler_desc.num_of_expected_params} "
-                                     f"parameters but found {len(parts) - 2}")
-                return self._generate_reply(HTTPStatus.BAD_REQUEST, resp_txt="Mandatory parameter(s) required",
-                                            content_type='text')
-            display_id = model.NONEXISTENT_DISPLAY_ID
-            if handler_desc.disp_id_req:
-                display_id = self._parse_display_id(headers)
-                if display_id == model.NONEXISTENT_DISPLAY_ID:
-                    return self._generate_reply(HTTPStatus.BAD_REQUEST,
-                                                resp_txt="Mandatory header is absent or incorrect",
-                                                content_type='text')
-            return handler_desc.handler(parts[2:], display_id, req_obj)
-        except IndexError as e:
-            self._logger.error(f"Failed to get endpoint or query parameter from the path - {str(e)}")
-            return self._generate_reply(HTTPStatus.INTERNAL_SERVER_ERROR)
+        return self._dispatch(self._handlers['PUT'], path, headers, req_obj)
 
     def _on_delete(self, path: str, headers: dict) -> RequestHandlerResult:
         self._logger.debug(f"Received DELETE request for {path}")
+        return self._dispatch(self._handlers['DELETE'], path, headers)
+
+    def _dispatch(self, handlers: dict[str, RequestHandlerDesc], path: str, headers: dict,
+                  *args) -> RequestHandlerResult:
+        """Finds the handler of the endpoint, validates the request against it and calls it.
+           Additional args (parsed request body) are passed to the handler after query parameters and display ID.
+        """
         try:
-            parts = path.split('/')
-            if parts[1] not in self._delete_handlers:
-                self._logger.warning(f"Endpoint {parts[1]} not found")
-                return self._generate_reply(HTTPStatus.NOT_FOUND, resp_txt=f"Endpoint {parts[1]} does not exist",
+            # Path is /<endpoint>[/<param>...]
+            endpoint, _, tail = path.partition('/')[2].partition('/')
+            params = tail.split('/') if tail else []
+            handler_desc = handlers.get(endpoint)
+            if handler_desc is None:
+                self._logger.warning(f"Endpoint {endpoint} not found")
+                return self._generate_reply(HTTPStatus.NOT_FOUND, resp_txt=f"Endpoint {endpoint} does not exist",
                                             content_type='text')
-            handler_desc = self._delete_handlers[parts[1]]
-            if (len(parts) - 2) < handler_desc.num_of_expected_params:
-                self._logger.warning(f"For endpoint {parts[1]} expected {handler_desc.num_of_expected_params} "
-                                     f"parameters but found {len(parts) - 2}")
+            if len(params) < handler_desc.num_of_expected_params:
+                self._logger.warning(f"For endpoint {endpoint} expected {handler_desc.num_of_expected_params} "
+                                     f"parameters but found {len(params)}")
                 return self._generate_reply(HTTPStatus.BAD_REQUEST, resp_txt="Mandatory parameter(s) required",
                                             content_type='text')
             display_id = model.NONEXISTENT_DISPLAY_ID
@@ -191,69 +178,74 @@ class BackendRestServer(RestServerBase):
                     return self._generate_reply(HTTPStatus.BAD_REQUEST,
                                                 resp_txt="Mandatory header is absent or incorrect",
                                                 content_type='text')
-            return handler_desc.handler(parts[2:], display_id)
+            return handler_desc.handler(params, display_id, *args)
         except IndexError as e:
             self._logger.error(f"Failed to get endpoint or query parameter from the path - {str(e)}")
             return self._generate_reply(HTTPStatus.INTERNAL_SERVER_ERROR)
 
     def _on_options(self, path: str, headers: dict) -> tuple[int, dict]:
-        out_headers = {"Allow": "GET, PUT, POST, OPTIONS",
-                       "Access-Control-Allow-Origin": "*",
-                       "Access-Control-Allow-Methods": "GET, PUT, POST, DELETE, OPTIONS",
-                       "Access-Control-Allow-Headers": "Content-Type, displayId"}
-        return HTTPStatus.OK, out_headers
-
-    def _generate_reply(self, status_code: int, resp_txt: str = "", resp_obj=None,
-                        content_type: str = 'none') -> RequestHandlerResult:
-        headers = dict()
-        headers['Access-Control-Allow-Origin'] = '*'
+        return HTTPStatus.OK, _OPTIONS_HEADERS
+
+    def _generate_reply(self, status_code: int, resp_txt: str = "", content_type: str = 'none') -> RequestHandlerResult:
+        """Generates a reply with a plain text body or without a body, see _reply_json* for JSON replies"""
         if content_type == 'text' and len(resp_txt) > 0:
-            headers['Content-Type'] = 'text/plain'
-            headers['Content-Length'] = str(len(resp_txt))
-            return status_code, headers, resp_txt
-        elif content_type == 'json' and resp_obj is not None:
-            headers['Content-Type'] = 'application/json'
-            if type(resp_obj) == dict:
-                try:
-                    resp_json = json.dumps(resp_obj)
-                except Exception as e:
-                    self._logger.error(f"Failed to generate JSON response data - {str(e)}")
-                    return HTTPStatus.INTERNAL_SERVER_ERROR, headers, ""
-            elif type(resp_obj) == str:
-                resp_json = resp_obj
-            else:
-                self._logger.error(f"Type of resp_obj {type(resp_obj)} is wrong to generate JSON response data")
-                return HTTPStatus.INTERNAL_SERVER_ERROR, headers, ""
-            headers['Content-Length'] = str(len(resp_json))
-            return status_code, headers, resp_json
+            body = resp_txt.encode()
+            # Content-Length is a number of bytes, not characters
+            return status_code, {**_TEXT_HEADERS, 'Content-Length': str(len(body))}, body
         elif content_type == 'none':
-            return status_code, headers, ""
+            return status_code, _CORS_HEADERS, b""
         else:
             self._logger.error(f"Failed to generate the reply for parameters: resp_text={resp_txt}, "
-                               f"reso_obj={resp_obj}, content_type={content_type}")
-            return HTTPStatus.INTERNAL_SERVER_ERROR, headers, ""
+                               f"content_type={content_type}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, _CORS_HEADERS, b""
+
+    def _reply_json(self, status_code: int, resp_obj: dict) -> RequestHandlerResult:
+        """Generates a reply with the object encoded to JSON"""
+        try:
+            body = _json_encoder.encode(resp_obj).encode()
+        except (TypeError, ValueError) as e:
+            self._logger.error(f"Failed to generate JSON response data - {str(e)}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, _CORS_HEADERS, b""
+        return status_code, {**_JSON_HEADERS, 'Content-Length': str(len(body))}, body
+
+    @staticmethod
+    def _reply_json_raw(status_code: int, body: bytes) -> RequestHandlerResult:
+        """Generates a reply with already encoded JSON, e.g. contents of a data file"""
+        return status_code, {**_JSON_HEADERS, 'Content-Length': str(len(body))}, body
 
     def _process_get_test(self, params: list, display_id: int) -> RequestHandlerResult:
         return self._generate_reply(HTTPStatus.OK, resp_txt=f"JER Kiosk UI backend", content_type='text')
 
     def _process_get_brand_info(self, params: list, display_id: int) -> RequestHandlerResult:
-        brand_info_path = self._data_dir.joinpath(self._config['brand_info_filename'])
-        if brand_info_path.exists():
-            with open(brand_info_path) as f:
-                brand_info = f.read()
-                return self._generate_reply(HTTPStatus.OK, resp_obj=brand_info, content_type='json')
+        brand_info = self._read_data_file(self._brand_info_path)
+        if brand_info is not None:
+            return self._reply_json_raw(HTTPStatus.OK, brand_info)
         else:
             return self._generate_reply(HTTPStatus.NOT_FOUND)
 
     def _process_get_ui_model(self, params: list, display_id: int) -> RequestHandlerResult:
-        ui_model_path = self._data_dir.joinpath(self._config['ui_model_filename'])
-        if ui_model_path.exists():
-            with open(ui_model_path) as f:
-                ui_model = f.read()
-                return self._generate_reply(HTTPStatus.OK, resp_obj=ui_model, content_type='json')
+        ui_model = self._read_data_file(self._ui_model_path)
+        if ui_model is not None:
+            return self._reply_json_raw(HTTPStatus.OK, ui_model)
         else:
             return self._generate_reply(HTTPStatus.NOT_FOUND)
 
+    def _read_data_file(self, path: Path) -> bytes | None:
+        """Returns contents of the file or None if it doesn't exist.
+           The file is read again only if it was modified since the last call, as the planogram logic replaces it.
+        """
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._data_file_cache.pop(path, None)
+            return None
+        cached = self._data_file_cache.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        data = path.read_bytes()
+        self._data_file_cache[path] = (mtime_ns, data)
+        return data
+
     def _process_get_collection(self, params: list, display_id: int) -> RequestHandlerResult:
         try:
             coll_id = int(params[0])
@@ -266,15 +258,12 @@ class BackendRestServer(RestServerBase):
             if coll is not None:
                 coll_obj = dict()
                 coll_obj['id'] = coll.obj_id
-                if self._lang in coll.info:
-                    coll_obj['name'] = coll.info[self._lang].name
-                else:
-                    coll_obj['name'] = '?'
+                coll_obj['name'] = coll.info.get(self._lang, _UNKNOWN_INFO).name
                 if coll.media_id is not None:
-                    coll_obj['image'] = self._config['media'] + coll.media.filename
+                    coll_obj['image'] = self._media_prefix + coll.media.filename
                 else:
                     coll_obj['image'] = ''
-                return self._generate_reply(HTTPStatus.OK, resp_obj=coll_obj, content_type='json')
+                return self._reply_json(HTTPStatus.OK, coll_obj)
             else:
                 return self._generate_reply(HTTPStatus.NOT_FOUND)
         except utils.DbError as e:
@@ -292,35 +281,22 @@ class BackendRestServer(RestServerBase):
             prod = self._db.get_product(prod_id)
             prod_obj = dict()
             prod_obj['id'] = prod.obj_id
-            if self._lang in prod.info:
-                prod_obj['name'] = prod.info[self._lang].name
-                prod_obj['description'] = prod.info[self._lang].description
-            else:
-                prod_obj['name'] = '?'
-                prod_obj['description'] = '?'
-            prod_obj['variants'] = list()
+            prod_info = prod.info.get(self._lang, _UNKNOWN_INFO)
+            prod_obj['name'] = prod_info.name
+            prod_obj['description'] = prod_info.description
             variants = self._db.get_variants(prod_id)
-            for var in variants:
-                var_obj = dict()
-                var_obj['id'] = var.obj_id
-                var_obj['price'] = var.price
-                var_obj['comparePrice'] = var.price_comp
-                var_obj['priceFormatted'] = var.price_fmt
-                var_obj['comparePriceFormatted'] = var.price_comp_fmt
-                if var.media_id is not None:
-                    var_obj['image'] = self._config['media'] + var.media.filename
-                else:
-                    var_obj['image'] = ''
-                inv_items = self._db.get_inventory_items_by_variant(var.obj_id)
-                quantity = 0
-                for item in inv_items:
-                    quantity += item.quantity
-                var_obj['available'] = quantity
-                var_obj['options'] = list()
-                for opt in var.options:
-                    var_obj['options'].append({'name': opt.option, 'value': opt.value})
-                prod_obj['variants'].append(var_obj)
-            return self._generate_reply(HTTPStatus.OK, resp_obj=prod_obj, content_type='json')
+            quantities = self._db.get_inventory_quantities_by_variants([var.obj_id for var in variants])
+            media_prefix = self._media_prefix
+            prod_obj['variants'] = [{'id': var.obj_id,
+                                     'price': var.price,
+                                     'comparePrice': var.price_comp,
+                                     'priceFormatted': var.price_fmt,
+                                     'comparePriceFormatted': var.price_comp_fmt,
+                                     'image': media_prefix + var.media.filename if var.media_id is not None else '',
+                                     'available': quantities.get(var.obj_id, 0),
+                                     'options': [{'name': opt.option, 'value': opt.value} for opt in var.options]}
+                                    for var in variants]
+            return self._reply_json(HTTPStatus.OK, prod_obj)
         except utils.DbError as e:
             # TODO: telemetry
             return self._generate_reply(HTTPStatus.INTERNAL_SERVER_ERROR)
@@ -331,16 +307,21 @@ class BackendRestServer(RestServerBase):
             if cart is None:
                 self._logger.warning(f"Trying to initiate transaction for display {display_id} but no cart is found")
                 return self._generate_reply(HTTPStatus.NOT_FOUND, resp_txt="No active cart", content_type='text')
-            self._tr_id_ready_flags[display_id - 1].clear()
-            self._tr_id_request_data[display_id - 1].cart_id = cart.obj_id
-            self._tr_id_request_data[display_id - 1].waiting = True
-            self._ev_bus.post(Event(EventType.BEGIN_TRANSACTION_REQUEST, {'cart_id': cart.obj_id}))
-            res = self._tr_id_ready_flags[display_id - 1].wait(self._config['transaction_id_timeout'])
-            self._tr_id_request_data[display_id - 1].waiting = False
-            if res and self._tr_id_request_data[display_id - 1].success:
-                cart = self._db.get_cart(self._tr_id_request_data[display_id - 1].cart_id)
+            tr_id_req = TransactionIdRequest(cart.obj_id)
+            with self._tr_id_requests_lock:
+                self._tr_id_requests[cart.obj_id] = tr_id_req
+            try:
+                self._ev_bus.post(Event(EventType.BEGIN_TRANSACTION_REQUEST, {'cart_id': cart.obj_id}))
+                res = tr_id_req.ready.wait(self._tr_id_timeout)
+            finally:
+                with self._tr_id_requests_lock:
+                    # A newer request for the same cart may have replaced this one already
+                    if self._tr_id_requests.get(cart.obj_id) is tr_id_req:
+                        del self._tr_id_requests[cart.obj_id]
+            if res and tr_id_req.success:
+                cart = self._db.get_cart(tr_id_req.cart_id)
                 resp = {'transactionId': cart.transaction_id}
-                return self._generate_reply(HTTPStatus.OK, resp_obj=resp, content_type='json')
+                return self._reply_json(HTTPStatus.OK, resp)
             return self._generate_reply(HTTPStatus.SERVICE_UNAVAILABLE, resp_txt="Failed to get transaction id",
                                         content_type='text')
         except utils.DbError as e:
@@ -357,10 +338,10 @@ class BackendRestServer(RestServerBase):
                                                model.CartType.LOCAL, req_obj['variantId'], req_obj['amount'])
             if res == CartOperationResult.OK:
                 resp = {'message': 'OK'}
-                return self._generate_reply(HTTPStatus.OK, resp_obj=resp, content_type='json')
+                return self._reply_json(HTTPStatus.OK, resp)
             elif res == CartOperationResult.NOK:
                 resp = {'message': 'NOK'}
-                return self._generate_reply(HTTPStatus.OK, resp_obj=resp, content_type='json')
+                return self._reply_json(HTTPStatus.OK, resp)
             elif res == CartOperationResult.ERROR:
                 return self._generate_reply(HTTPStatus.BAD_REQUEST, resp_txt=msg, content_type='text')
             else:
@@ -373,7 +354,7 @@ class BackendRestServer(RestServerBase):
         # At the moment it is only supported when transaction ID is not assigned yet
         self._cart_logic.clear(self._get_my_transaction_id(display_id))
         resp = {'message': 'OK'}
-        return self._generate_reply(HTTPStatus.OK, resp_obj=resp, content_type='json')
+        return self._reply_json(HTTPStatus.OK, resp)
 
     def _process_post_pickup(self, params: list, display_id: int, req_obj: dict) -> RequestHandlerResult:
         try:
@@ -396,7 +377,7 @@ class BackendRestServer(RestServerBase):
                 else:
                     self._logger.info("No entries found in order history for the given pickup code")
                 resp = {'status': status}
-                return self._generate_reply(HTTPStatus.OK, resp_obj=resp, content_type='json')
+                return self._reply_json(HTTPStatus.OK, resp)
             else:
                 # Normally, only single cart should be found.
                 # There is no way to choose a correct cart if there are more than one
@@ -409,27 +390,22 @@ class BackendRestServer(RestServerBase):
                     resp = dict()
                     resp['status'] = "OK" if res == CartOperationResult.OK else "PENDING"
                     resp['order'] = list()
-                    cart_contents = self._db.get_cart_items(cart.obj_id)
-                    for item in cart_contents:
-                        var = self._db.get_variant(item.variant_id)
-                        prod = self._db.get_product(var.prod_id)
-                        var_name = ""
-                        if self._lang in prod.info:
-                            var_name = prod.info[self._lang].name
-                        if self._lang in var.info and var.info[self._lang].name != var_name:
-                            var_name = f"{var_name} ({var.info[self._lang].name})"
+                    for item in self._db.get_order_items(cart.obj_id):
+                        var_name = item.product_name or ""
+                        if item.variant_name is not None and item.variant_name != var_name:
+                            var_name = f"{var_name} ({item.variant_name})"
                         var_obj = dict()
-                        var_obj['variantId'] = var.obj_id
+                        var_obj['variantId'] = item.variant_id
                         var_obj['name'] = var_name
                         var_obj['image'] = ''
-                        if var.media_id is not None:
-                            var_obj['image'] = self._config['media'] + var.media.filename
+                        if item.image is not None:
+                            var_obj['image'] = self._media_prefix + item.image
                         var_obj['amount'] = item.amount
                         resp['order'].append(var_obj)
-                    return self._generate_reply(HTTPStatus.OK, resp_obj=resp, content_type='json')
+                    return self._reply_json(HTTPStatus.OK, resp)
                 elif res == CartOperationResult.NOK or res == CartOperationResult.ERROR:
                     resp = {'status': 'NOK'}
-                    return self._generate_reply(HTTPStatus.OK, resp_obj=resp, content_type='json')
+                    return self._reply_json(HTTPStatus.OK, resp)
                 else:
                     return self._generate_reply(HTTPStatus.INTERNAL_SERVER_ERROR)
         except KeyError as e:
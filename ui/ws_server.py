@@ -7,10 +7,18 @@ from db.database import Database
 from core import utils
 import json
 from enum import auto, unique
-from threading import Thread, Timer
+from threading import Thread
+from urllib.parse import urlsplit, parse_qs
 import websockets
 import asyncio
-from concurrent.futures import wait
+try:
+    # Optional faster event loop, the standard one is used if it is not installed (e.g. not available on Windows)
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Messages are encoded without whitespace by a single encoder instance shared by all messages
+_json_encoder = json.JSONEncoder(separators=(',', ':'))
 
 
 @unique
@@ -49,7 +57,9 @@ class BackendWebsocketServer(AppModuleWithEvents):
     """Handles WebSocket connections with the Kiosk UI"""
     MYNAME = 'ui.ws'
     REQ_CFG_OPTIONS = ['port', 'keep_alive_interval', 'keep_alive_log']
-    CONN_KEY = '?displayId='
+    CONN_KEY = 'displayId'
+    # Maximum number of messages waiting to be sent to one display, the oldest one is dropped on overflow
+    SEND_QUEUE_SIZE = 64
     MACHINE_STATE_STR = {model.MachineState.STARTUP: 'startup',
                          model.MachineState.AVAILABLE: 'available',
                          model.MachineState.UNAVAILABLE: 'unavailable',
@@ -57,11 +67,18 @@ class BackendWebsocketServer(AppModuleWithEvents):
                          model.MachineState.MAINTENANCE: 'maintenance',
                          model.MachineState.ERROR: 'error',
                          model.MachineState.UPDATE: 'sw-update'}
-    DISPENSING_STATUS_STR = {model.DispensingStatus.STARTED_ONE_ITEM: 'dispensing_started',
-                             model.DispensingStatus.FINISHED_ONE_ITEM: 'dispensed_one_item',
-                             model.DispensingStatus.ERROR_ONE_ITEM: 'dispensed_one_item',
-                             model.DispensingStatus.WAITING_FOR_PICKUP: 'wait_for_pickup',
-                             model.DispensingStatus.COMPLETED: 'dispensed_all_items'}
+    # Messages which don't depend on event data are serialized once
+    MACHINE_STATE_MSG = {state: _json_encoder.encode({'messageType': 'machineStatus', 'status': state_str})
+                         for state, state_str in MACHINE_STATE_STR.items()}
+    BRAND_INFO_UPDATED_MSG = _json_encoder.encode({'messageType': 'brandInfoUpdated'})
+    UI_MODEL_UPDATED_MSG = _json_encoder.encode({'messageType': 'uiModelUpdated'})
+    # Indexed by DispensingStatus value
+    DISPENSING_STATUS_STR = (None,
+                             'dispensing_started',    # STARTED_ONE_ITEM
+                             'dispensed_one_item',    # FINISHED_ONE_ITEM
+                             'dispensed_one_item',    # ERROR_ONE_ITEM
+                             'wait_for_pickup',       # WAITING_FOR_PICKUP
+                             'dispensed_all_items')   # COMPLETED
 
     def __init__(self, config_data: dict, logger: Logger, ev_bus: EventBus, db: Database):
         super().__init__(BackendWebsocketServer.MYNAME, config_data, logger)
@@ -70,21 +87,31 @@ class BackendWebsocketServer(AppModuleWithEvents):
         self._work_thread: Thread = None
         self._ws_server: websockets.WebSocketServer = None
         self._connections: dict[int, websockets.WebSocketServerProtocol] = dict()
+        # Outgoing messages of every connection, drained by its writer task on the event loop
+        self._send_queues: dict[int, asyncio.Queue] = dict()
         self._machine_state: model.MachineState = model.MachineState.STARTUP
-        self._keepalive_tm = None
+        # Keep-alive is scheduled on the event loop once the server is started
+        self._keepalive_handle: asyncio.TimerHandle | None = None
+        self._keepalive_log = False
         self._async_loop = None
+        # Set on the event loop to shut the server down
+        self._stop_event = asyncio.Event()
         self._last_dispensing_status: dict[int, model.DispensingStatus] = dict()
+        # Display ID and checkout method of the carts being dispensed, by cart ID, kept until dispensing is completed
+        self._dispensing_carts: dict[int, tuple[int, model.CheckoutMethod]] = dict()
 
     def _get_my_required_cfg_options(self) -> list:
         return BackendWebsocketServer.REQ_CFG_OPTIONS
 
     def start(self):
+        # The loop is created before the module gets any events, so messages can be handed over to it at any time,
+        # they are processed once the server thread runs the loop
+        self._async_loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
         super().start()
         self._work_thread = Thread(target=self._start_service)
         self._work_thread.start()
-        for display_id in range(1, model.MAX_DISPLAYS):
-            self._last_dispensing_status[display_id] = model.DispensingStatus.COMPLETED
-        self._keepalive_tm = Timer(self._config['keep_alive_interval'], self._keepalive_tm_handler)
+        self._keepalive_log = bool(self._config['keep_alive_log'])
+        self._last_dispensing_status = dict.fromkeys(range(1, model.MAX_DISPLAYS + 1), model.DispensingStatus.COMPLETED)
         self._ev_bus.subscribe(EventType.MACHINE_STATE_CHANGED, self._app_event_handler)
         self._ev_bus.subscribe(EventType.BRAND_INFO_UPDATED, self._app_event_handler)
         self._ev_bus.subscribe(EventType.UI_MODEL_UPDATED, self._app_event_handler)
@@ -97,52 +124,47 @@ class BackendWebsocketServer(AppModuleWithEvents):
         self._register_ev_handler(WsEventType.HUMAN_DETECTED, self._process_human_detected)
 
     def stop(self):
-        if self._keepalive_tm:
-            self._keepalive_tm.cancel()
         super().stop()
-        if self._ws_server and self._ws_server.is_serving():
-            future = asyncio.run_coroutine_threadsafe(self._close_server(), self._async_loop)
-            wait((future,))
-        if self._async_loop:
-            self._async_loop.close()
-        self._logger.info(f"Websocket server on port {self._config['port']} shut down")
+        if self._async_loop and not self._async_loop.is_closed():
+            self._async_loop.call_soon_threadsafe(self._stop_event.set)
         if self._work_thread:
-            self._async_loop.stop()
             self._work_thread.join()
+        self._logger.info(f"Websocket server on port {self._config['port']} shut down")
 
     async def _server_co(self):
-        self._ws_server = await websockets.serve(self._connection_handler, port=self._config['port'])
-        await self._ws_server.serve_forever()
-
-    async def _close_server(self):
-        self._ws_server.close()
-        await self._ws_server.wait_closed()
+        # Connections are closed and the server is shut down on exit from the context
+        async with websockets.serve(self._connection_handler, port=self._config['port']) as self._ws_server:
+            self._keepalive_handle = self._async_loop.call_later(self._config['keep_alive_interval'],
+                                                                 self._keepalive_cb)
+            await self._stop_event.wait()
+            self._keepalive_handle.cancel()
 
     def _start_service(self):
         """Executes Websocket server loop and blocks on it"""
         self._logger.info(f"Starting Websocket server on port {self._config['port']}")
-        self._async_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self._async_loop)
         try:
             self._async_loop.run_until_complete(self._server_co())
-        except asyncio.CancelledError:
-            self._async_loop.run_until_complete(self._close_server())
+        finally:
+            self._async_loop.close()
 
     async def _connection_handler(self, ws: websockets.WebSocketServerProtocol):
         """Called by the Websocket Server when a new connection is established"""
-        s_before, s_sep, s_after = ws.path.rpartition(BackendWebsocketServer.CONN_KEY)
-        if s_sep == '':
+        raw_id = parse_qs(urlsplit(ws.path).query).get(BackendWebsocketServer.CONN_KEY, [None])[0]
+        if not raw_id:
             self._logger.warning(f"Websocket connection path ({ws.path}) does not contain required parameter")
             return
-        try:
-            display_id = int(s_after)
-        except ValueError as e:
-            self._logger.error(f"Failed to get display id from the websocket connection path ({ws.path}) - {str(e)}")
+        if not raw_id.isdecimal():
+            self._logger.error(f"Failed to get display id from the websocket connection path ({ws.path})")
             return
+        display_id = int(raw_id)
         if display_id == model.NONEXISTENT_DISPLAY_ID or display_id > model.MAX_DISPLAYS:
             self._logger.warning(f"Invalid display id received - {display_id}")
             return
+        send_queue = asyncio.Queue(maxsize=BackendWebsocketServer.SEND_QUEUE_SIZE)
         self._connections[display_id] = ws
+        self._send_queues[display_id] = send_queue
+        writer_task = asyncio.create_task(self._writer_co(display_id, ws, send_queue))
         self._logger.info(f"Established Websocket connection with Kiosk UI display id {display_id}")
         try:
             async for msg in ws:
@@ -150,13 +172,47 @@ class BackendWebsocketServer(AppModuleWithEvents):
                 pass
         except websockets.ConnectionClosedError:
             pass
-        del self._connections[display_id]
+        writer_task.cancel()
+        # The display may have reconnected already, then its new connection is kept
+        if self._connections.get(display_id) is ws:
+            del self._connections[display_id]
+            del self._send_queues[display_id]
         self._logger.info(f"Closed Websocket connection with Kiosk UI display id {display_id}")
 
-    def _keepalive_tm_handler(self):
+    async def _writer_co(self, display_id: int, ws: websockets.WebSocketServerProtocol, send_queue: asyncio.Queue):
+        """Sends queued messages to the display one by one until the connection is closed"""
+        while True:
+            out_str = await send_queue.get()
+            try:
+                await ws.send(out_str)
+            except websockets.ConnectionClosed:
+                self._logger.warning(f"Failed to send message to Kiosk UI display {display_id} "
+                                     "due to closed connection")
+                return
+
+    def _enqueue(self, display_id: int, out_str: str):
+        """Queues the message for sending to the display, called on the event loop"""
+        send_queue = self._send_queues.get(display_id)
+        if send_queue is not None:
+            self._put_to_queue(display_id, send_queue, out_str)
+
+    def _enqueue_all(self, out_str: str):
+        """Queues the message for sending to all connected displays, called on the event loop"""
+        for display_id, send_queue in self._send_queues.items():
+            self._put_to_queue(display_id, send_queue, out_str)
+
+    def _put_to_queue(self, display_id: int, send_queue: asyncio.Queue, out_str: str):
+        """Queues the message, dropping the oldest one if the display does not keep up with sending"""
+        if send_queue.full():
+            send_queue.get_nowait()
+            self._logger.warning(f"Send queue of Kiosk UI display {display_id} is full, the oldest message is dropped")
+        send_queue.put_nowait(out_str)
+
+    def _keepalive_cb(self):
+        """Called on the event loop, sends the machine state and schedules itself again"""
         if self._machine_state != model.MachineState.STARTUP:
             self._send_machine_state()
-        self._keepalive_tm = Timer(self._config['keep_alive_interval'], self._keepalive_tm_handler)
+        self._keepalive_handle = self._async_loop.call_later(self._config['keep_alive_interval'], self._keepalive_cb)
 
     def _app_event_handler(self, ev: Event):
         """Processes external events"""
@@ -179,49 +235,53 @@ class BackendWebsocketServer(AppModuleWithEvents):
             self._logger.error(f"Failed to access input parameter - {str(e)}")
 
     def _process_brand_info_updated(self, params: dict):
-        msg = {'messageType': 'brandInfoUpdated'}
-        self._broadcast_msg(msg)
+        self._broadcast_serialized(BackendWebsocketServer.BRAND_INFO_UPDATED_MSG)
 
     def _process_ui_model_updated(self, params: dict):
-        msg = {'messageType': 'uiModelUpdated'}
-        self._broadcast_msg(msg)
+        self._broadcast_serialized(BackendWebsocketServer.UI_MODEL_UPDATED_MSG)
 
     def _process_dispensing_status(self, params: dict):
         try:
             cart_id = params['cart_id']
             variant_id = params['variant_id']
             status = params['status']
-            cart = self._db.get_cart(cart_id)
-            if cart is None:
-                self._logger.error(f"Failed to find cart {cart_id}")
-                return
-            if (cart.checkout_method == model.CheckoutMethod.LOCAL or
-                    cart.checkout_method == model.CheckoutMethod.PICKUP):
-                last_status = self._last_dispensing_status[cart.display_id]
-                self._logger.debug(f"Dispensing status for cart {cart_id} display {cart.display_id} changed from "
+            cart_info = self._dispensing_carts.get(cart_id)
+            if cart_info is None:
+                cart = self._db.get_cart(cart_id)
+                if cart is None:
+                    self._logger.error(f"Failed to find cart {cart_id}")
+                    return
+                cart_info = (cart.display_id, cart.checkout_method)
+                self._dispensing_carts[cart_id] = cart_info
+            display_id, checkout_method = cart_info
+            if status == model.DispensingStatus.COMPLETED:
+                del self._dispensing_carts[cart_id]
+            if (checkout_method == model.CheckoutMethod.LOCAL or
+                    checkout_method == model.CheckoutMethod.PICKUP):
+                last_status = self._last_dispensing_status[display_id]
+                self._logger.debug(f"Dispensing status for cart {cart_id} display {display_id} changed from "
                                    f"status {last_status} to status {status}")
-                msg = dict()
-                msg['messageType'] = 'dispensingStatus'
-                msg['eventType'] = BackendWebsocketServer.DISPENSING_STATUS_STR[status]
                 if status == model.DispensingStatus.STARTED_ONE_ITEM:
                     if (last_status == model.DispensingStatus.COMPLETED or
                             last_status == model.DispensingStatus.WAITING_FOR_PICKUP):
-                        self._send_msg(cart.display_id, msg)
+                        self._send_msg(display_id, {'messageType': 'dispensingStatus',
+                                                    'eventType': BackendWebsocketServer.DISPENSING_STATUS_STR[status]})
                 elif status == model.DispensingStatus.FINISHED_ONE_ITEM:
-                    msg['status'] = True
-                    msg['variantId'] = variant_id
-                    self._send_msg(cart.display_id, msg)
+                    self._send_msg(display_id, {'messageType': 'dispensingStatus',
+                                                'eventType': BackendWebsocketServer.DISPENSING_STATUS_STR[status],
+                                                'status': True,
+                                                'variantId': variant_id})
                 elif status == model.DispensingStatus.ERROR_ONE_ITEM:
-                    msg['status'] = False
-                    msg['variantId'] = variant_id
-                elif status == model.DispensingStatus.WAITING_FOR_PICKUP:
-                    self._send_msg(cart.display_id, msg)
-                elif status == model.DispensingStatus.COMPLETED:
-                    self._send_msg(cart.display_id, msg)
+                    # Not reported to the display at the moment
+                    pass
+                elif (status == model.DispensingStatus.WAITING_FOR_PICKUP or
+                        status == model.DispensingStatus.COMPLETED):
+                    self._send_msg(display_id, {'messageType': 'dispensingStatus',
+                                                'eventType': BackendWebsocketServer.DISPENSING_STATUS_STR[status]})
                 else:
                     self._logger.warning(f"Unexpected dispensing status: {status}")
                     return
-                self._last_dispensing_status[cart.display_id] = status
+                self._last_dispensing_status[display_id] = status
         except KeyError as e:
             self._logger.error(f"Failed to access input parameter - {str(e)}")
         except utils.DbError as e:
@@ -234,34 +294,30 @@ class BackendWebsocketServer(AppModuleWithEvents):
             if display_id <= model.NONEXISTENT_DISPLAY_ID or display_id > model.MAX_DISPLAYS:
                 self._logger.warning(f"Invalid display id: {display_id}")
                 return
-            msg = dict()
-            msg['messageType'] = 'humanDetected'
-            msg['profileId'] = params['profileId']
-            self._send_msg(display_id, msg)
+            self._send_msg(display_id, {'messageType': 'humanDetected', 'profileId': params['profileId']})
         except KeyError as e:
             self._logger.error(f"Failed to access input parameter - {str(e)}")
 
     def _send_machine_state(self):
-        msg = dict()
-        msg['messageType'] = "machineStatus"
-        msg['status'] = BackendWebsocketServer.MACHINE_STATE_STR[self._machine_state]
-        self._broadcast_msg(msg, log=True if self._config['keep_alive_log'] else False)
+        self._broadcast_serialized(BackendWebsocketServer.MACHINE_STATE_MSG[self._machine_state],
+                                   log=self._keepalive_log)
 
     def _send_msg(self, display_id: int, msg: dict, log: bool = True):
+        # Only a quick check to not encode messages for absent displays, the connection may still close before the
+        # message is queued, then it is dropped on the event loop
         if display_id not in self._connections:
             return
-        out_str = json.dumps(msg)
-        try:
-            future = asyncio.run_coroutine_threadsafe(self._connections[display_id].send(out_str), self._async_loop)
-            wait((future,))
-            if log:
-                self._logger.debug(f"Sent message to Kiosk UI display {display_id} - ({out_str})")
-        except websockets.ConnectionClosed:
-            self._logger.warning(f"Failed to send message to Kiosk UI display {display_id} "
-                                 "due to closed connection")
-        except TypeError as e:
-            self._logger.error(f"Failed to send message to Kiosk UI display {display_id} - {str(e)}")
+        out_str = _json_encoder.encode(msg)
+        # The message is handed over to the event loop without waiting until it is sent
+        self._async_loop.call_soon_threadsafe(self._enqueue, display_id, out_str)
+        if log:
+            self._logger.debug("Sent message to Kiosk UI display %d - (%s)", display_id, out_str)
 
-    def _broadcast_msg(self, msg: dict, log: bool = True):
-        for display_id in self._connections.keys():
-            self._send_msg(display_id, msg, log)
+    def _broadcast_serialized(self, out_str: str, log: bool = True):
+        """Sends already serialized message to all connected displays"""
+        if not self._connections:
+            return
+        # Handed over to the event loop once for all displays
+        self._async_loop.call_soon_threadsafe(self._enqueue_all, out_str)
+        if log:
+            self._logger.debug("Sent message to all Kiosk UI displays - (%s)", out_str)